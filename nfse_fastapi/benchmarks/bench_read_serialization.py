@@ -0,0 +1,139 @@
+"""
+Micro-benchmark do caminho de leitura de `/api/nfses`.
+
+Compara o caminho antigo (objetos ORM + dict campo a campo com strftime/isoformat +
+json padrão) com o atual (projeção Core + orjson), em linhas por segundo.
+
+Uso (dentro de nfse_fastapi/):
+    python benchmarks/bench_read_serialization.py [--rows 20000] [--page 500] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson  # noqa: E402
+from sqlalchemy import desc, insert  # noqa: E402
+
+from models.base import Base  # noqa: E402
+from models.invoice import Invoice  # noqa: E402
+from services.database_service import DatabaseService  # noqa: E402
+
+
+def seed(db: DatabaseService, rows: int) -> None:
+    now = datetime.now()
+    payload = [
+        {
+            "uuid": f"bench-{i:08d}",
+            "cnpj": "12345678000190",
+            "date": date(2024, 1, 1) + timedelta(days=i % 365),
+            "client_cnpj": "98765432000110",
+            "client_phone": "11999990000",
+            "client_email": "cliente@example.com",
+            "invoice_value": 100.0 + i,
+            "cnae_code": "620150100",
+            "cnae_service": "Suporte técnico",
+            "city": "São Paulo/SP",
+            "invoice_description": "Serviço de suporte técnico mensal " * 4,
+            "numero_nfse": f"NFSE-{i:08X}",
+            "pdf_url": f"downloads/nfse_{i}.pdf",
+            "xml_url": f"downloads/nfse_{i}.xml",
+            "status": "SUCCESS",
+            "attempts": 1,
+            "created_at": now - timedelta(seconds=i),
+            "updated_at": now - timedelta(seconds=i),
+        }
+        for i in range(rows)
+    ]
+    with db.engine.begin() as conn:
+        conn.execute(insert(Invoice), payload)
+
+
+def legacy_list(db: DatabaseService, limit: int, offset: int) -> bytes:
+    """Caminho anterior: ORM completo + formatação campo a campo + json padrão."""
+    session = db.get_session()
+    try:
+        nfses = session.query(Invoice).order_by(desc(Invoice.created_at)).limit(limit).offset(offset).all()
+        data = []
+        for nfse in nfses:
+            data.append({
+                "id": nfse.id,
+                "uuid": nfse.uuid,
+                "cnpj": nfse.cnpj,
+                "date": nfse.date.strftime("%d/%m/%Y") if isinstance(nfse.date, (datetime, date)) else nfse.date,
+                "client_cnpj": nfse.client_cnpj,
+                "client_phone": nfse.client_phone,
+                "client_email": nfse.client_email,
+                "invoice_value": float(nfse.invoice_value) if nfse.invoice_value is not None else None,
+                "cnae_code": nfse.cnae_code,
+                "cnae_service": nfse.cnae_service,
+                "city": nfse.city,
+                "invoice_description": nfse.invoice_description,
+                "numero_nfse": nfse.numero_nfse,
+                "pdf_url": nfse.pdf_url,
+                "xml_url": nfse.xml_url,
+                "status": nfse.status,
+                "attempts": nfse.attempts,
+                "error_code": nfse.error_code,
+                "created_at": nfse.created_at.isoformat() if isinstance(nfse.created_at, (datetime, date)) else nfse.created_at,
+                "updated_at": nfse.updated_at.isoformat() if isinstance(nfse.updated_at, (datetime, date)) else nfse.updated_at,
+            })
+    finally:
+        session.close()
+    body = {"success": True, "data": data, "pagination": {"limit": limit, "offset": offset}}
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def lean_list(db: DatabaseService, limit: int, offset: int, fields=None) -> bytes:
+    """Caminho atual: projeção Core + orjson."""
+    data = db.list_nfses(limit=limit, offset=offset, fields=fields)
+    return orjson.dumps({"success": True, "data": data, "pagination": {"limit": limit, "offset": offset}})
+
+
+def run(label: str, fn, rows: int, page: int, repeat: int) -> float:
+    pages = max(rows // page, 1)
+    fn(0)  # aquecimento
+    start = time.perf_counter()
+    served = 0
+    for i in range(repeat):
+        fn((i % pages) * page)
+        served += page
+    elapsed = time.perf_counter() - start
+    rate = served / elapsed
+    print(f"{label:<28} {rate:>12,.0f} linhas/s  ({elapsed:.3f}s para {served} linhas)")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseService(f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}")
+        Base.metadata.create_all(db.engine)
+        seed(db, args.rows)
+
+        # Mesma saída nos dois caminhos (exceto a ordem de chaves/escapes do encoder)
+        assert json.loads(legacy_list(db, 5, 0)) == json.loads(lean_list(db, 5, 0))
+
+        before = run("ORM + json (antes)", lambda o: legacy_list(db, args.page, o), args.rows, args.page, args.repeat)
+        after = run("Core + orjson (depois)", lambda o: lean_list(db, args.page, o), args.rows, args.page, args.repeat)
+        sparse = run(
+            "Core + orjson, fields=3",
+            lambda o: lean_list(db, args.page, o, ["uuid", "status", "numero_nfse"]),
+            args.rows, args.page, args.repeat,
+        )
+        print(f"\nGanho: {after / before:.1f}x (completo), {sparse / before:.1f}x (sparse fieldset)")
+        db.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark de escrita concorrente no SQLite.
+
+Simula `--emitters` emissões simultâneas como tarefas asyncio, do mesmo jeito que
+`process_nfse_emission`: cada uma faz o ciclo de escritas (create_nfse, create_log,
+increment_attempts, update_nfse, create_log) `--cycles` vezes, aguardando o banco
+via `DatabaseService.run_async`. Roda no modo padrão e no modo de produção
+(`SQLITE_PRODUCTION_MODE`: WAL + PRAGMAs + thread gravadora única), e também no modo
+de produção com as chamadas síncronas direto no event loop, para comparação.
+
+Uso (dentro de nfse_fastapi/):
+    python benchmarks/bench_sqlite_writes.py [--emitters 32] [--cycles 25]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.base import Base  # noqa: E402
+from services.database_service import DatabaseService  # noqa: E402
+
+PAYLOAD = {
+    "cnpj_emissor": "12345678000190",
+    "senha_emissor": "x",
+    "data_emissao": "01/02/2024",
+    "cnpj_cliente": "98765432000110",
+    "telefone_cliente": "11999990000",
+    "email_cliente": "cliente@example.com",
+    "valor": 150.0,
+    "cnae_code": "620150100",
+    "cnae_service": "Suporte técnico",
+    "city": "São Paulo/SP",
+    "descricao_servico": "Serviço de suporte técnico mensal",
+}
+WRITES_PER_CYCLE = 5
+
+
+async def emitter(db: DatabaseService, cycles: int) -> int:
+    errors = 0
+    for _ in range(cycles):
+        try:
+            record = await db.run_async(db.create_nfse, PAYLOAD)
+            await db.run_async(db.create_log, record["uuid"], "PROCESSING", "Iniciando emissão")
+            await db.run_async(db.increment_attempts, record["uuid"])
+            await db.run_async(db.update_nfse, record["uuid"], {"status": "SUCCESS", "numero_nfse": "NFSE-BENCH"})
+            await db.run_async(db.create_log, record["uuid"], "SUCCESS", "NFSe emitida com sucesso")
+        except Exception:
+            errors += 1
+    return errors
+
+
+async def blocking_emitter(db: DatabaseService, cycles: int) -> int:
+    """Mesmo ciclo, mas chamando o banco de forma síncrona dentro da corrotina."""
+    errors = 0
+    for _ in range(cycles):
+        try:
+            record = db.create_nfse(PAYLOAD)
+            db.create_log(record["uuid"], "PROCESSING", "Iniciando emissão")
+            db.increment_attempts(record["uuid"])
+            db.update_nfse(record["uuid"], {"status": "SUCCESS", "numero_nfse": "NFSE-BENCH"})
+            db.create_log(record["uuid"], "SUCCESS", "NFSe emitida com sucesso")
+        except Exception:
+            errors += 1
+        await asyncio.sleep(0)
+    return errors
+
+
+async def run(label: str, production_mode: bool, emitters: int, cycles: int, blocking: bool = False) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseService(
+            f"sqlite:///{os.path.join(tmp, 'bench.sqlite')}",
+            sqlite_production_mode=production_mode,
+        )
+        Base.metadata.create_all(db.engine)
+
+        task = blocking_emitter if blocking else emitter
+        start = time.perf_counter()
+        errors = sum(await asyncio.gather(*(task(db, cycles) for _ in range(emitters))))
+        elapsed = time.perf_counter() - start
+        batches = db.write_queue.stats() if db.write_queue is not None else None
+        db.dispose()
+
+    writes = emitters * cycles * WRITES_PER_CYCLE
+    batch_info = f", lote médio {batches['avg_batch']}, máx {batches['max_batch']}" if batches else ""
+    print(
+        f"{label:<30} {writes / elapsed:>10,.0f} escritas/s  "
+        f"({elapsed:.2f}s, {emitters} emissores, ciclos com erro: {errors}{batch_info})"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emitters", type=int, default=32)
+    parser.add_argument("--cycles", type=int, default=25)
+    args = parser.parse_args()
+
+    asyncio.run(run("padrão (rollback journal)", False, args.emitters, args.cycles))
+    asyncio.run(run("produção (WAL + gravador)", True, args.emitters, args.cycles))
+    asyncio.run(run("produção, síncrono no loop", True, args.emitters, args.cycles, blocking=True))
+
+
+if __name__ == "__main__":
+    main()
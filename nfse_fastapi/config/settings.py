@@ -30,10 +30,70 @@ class Settings:
     DB_USERNAME: str = os.getenv("DB_USERNAME", "")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
     DB_PORT: int = int(os.getenv("DB_PORT", 3306))
+    # Cria as tabelas na inicialização somente se ainda não existirem (desligue ao usar migrações)
+    DB_AUTO_CREATE_SCHEMA: bool = os.getenv("DB_AUTO_CREATE_SCHEMA", "True").lower() == "true"
+    DB_PREWARM_CONNECTIONS: int = int(os.getenv("DB_PREWARM_CONNECTIONS", "2"))
+    # Backoff entre tentativas de aquecimento que falharam (/ready fica 503 até dar certo)
+    WARMUP_RETRY_BASE_DELAY: float = float(os.getenv("WARMUP_RETRY_BASE_DELAY", "1"))
+    WARMUP_RETRY_MAX_DELAY: float = float(os.getenv("WARMUP_RETRY_MAX_DELAY", "30"))
+    # Threads usadas pelas chamadas ao banco vindas de corrotinas (DatabaseService.run_async)
+    DB_ASYNC_WORKERS: int = int(os.getenv("DB_ASYNC_WORKERS", "32"))
+
+    # ---------- SQLite em produção ----------
+    # WAL + PRAGMAs ajustados, uma única thread gravadora e pool de leitura somente leitura
+    SQLITE_PRODUCTION_MODE: bool = os.getenv("SQLITE_PRODUCTION_MODE", "False").lower() == "true"
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_MMAP_SIZE_MB: int = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+    SQLITE_WRITE_BATCH_SIZE: int = int(os.getenv("SQLITE_WRITE_BATCH_SIZE", "64"))
+    SQLITE_READ_POOL_SIZE: int = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
 
     # ---------- Playwright ----------
     PLAYWRIGHT_HEADLESS: bool = os.getenv("PLAYWRIGHT_HEADLESS", "True").lower() == "true"
     PLAYWRIGHT_TIMEOUT: int = int(os.getenv("PLAYWRIGHT_TIMEOUT", "30000"))
+    PLAYWRIGHT_PREWARM: bool = os.getenv("PLAYWRIGHT_PREWARM", "False").lower() == "true"
+    S3_PREWARM: bool = os.getenv("S3_PREWARM", "False").lower() == "true"
+
+    # ---------- Memória do navegador ----------
+    BROWSER_MAX_CONTEXTS: int = int(os.getenv("BROWSER_MAX_CONTEXTS", "8"))
+    BROWSER_MEMORY_BUDGET_MB: int = int(os.getenv("BROWSER_MEMORY_BUDGET_MB", "2048"))
+    BROWSER_CONTEXT_MEMORY_MB: int = int(os.getenv("BROWSER_CONTEXT_MEMORY_MB", "250"))  # estimativa por emissão
+    BROWSER_RECYCLE_RSS_MB: int = int(os.getenv("BROWSER_RECYCLE_RSS_MB", "1536"))  # 0 desativa
+    BROWSER_MAX_AGE_SECONDS: float = float(os.getenv("BROWSER_MAX_AGE_SECONDS", "1800"))  # 0 desativa
+
+    # ---------- Novas tentativas ----------
+    NFSE_RETRY_MAX_ATTEMPTS: int = int(os.getenv("NFSE_RETRY_MAX_ATTEMPTS", "3"))
+    NFSE_RETRY_BASE_DELAY: float = float(os.getenv("NFSE_RETRY_BASE_DELAY", "5"))
+    NFSE_RETRY_MAX_DELAY: float = float(os.getenv("NFSE_RETRY_MAX_DELAY", "120"))
+    # A cada NFSE_RECONCILE_INTERVAL cada processo renova o updated_at das emissões que
+    # tem em andamento; NFSes em PROCESSING/RETRYING sem atualização há mais de
+    # NFSE_STALE_AFTER_SECONDS perderam seu processo (reinício, deploy) e vão para
+    # DEAD_LETTER. O intervalo precisa ser bem menor que o prazo.
+    NFSE_STALE_AFTER_SECONDS: float = float(os.getenv("NFSE_STALE_AFTER_SECONDS", "1800"))
+    NFSE_RECONCILE_INTERVAL: float = float(os.getenv("NFSE_RECONCILE_INTERVAL", "60"))
+
+    # ---------- Concorrência adaptativa (portal NFSe) ----------
+    NFSE_CONCURRENCY_MIN: int = int(os.getenv("NFSE_CONCURRENCY_MIN", "1"))
+    NFSE_CONCURRENCY_MAX: int = int(os.getenv("NFSE_CONCURRENCY_MAX", "16"))  # limitado ao máximo de contextos do navegador
+    NFSE_CONCURRENCY_INITIAL: int = int(os.getenv("NFSE_CONCURRENCY_INITIAL", "2"))
+    NFSE_CONCURRENCY_LATENCY_TARGET: float = float(os.getenv("NFSE_CONCURRENCY_LATENCY_TARGET", "90"))  # segundos
+    NFSE_CONCURRENCY_DECREASE_FACTOR: float = float(os.getenv("NFSE_CONCURRENCY_DECREASE_FACTOR", "0.5"))
+    NFSE_CONCURRENCY_PER_EMITTER: int = int(os.getenv("NFSE_CONCURRENCY_PER_EMITTER", "0"))  # 0 = sem teto
+
+    # ---------- Idempotência ----------
+    IDEMPOTENCY_WINDOW_SECONDS: int = int(os.getenv("IDEMPOTENCY_WINDOW_SECONDS", "86400"))
+    # Sem cabeçalho Idempotency-Key, deriva a chave do payload (sem a senha)
+    IDEMPOTENCY_AUTO_KEY: bool = os.getenv("IDEMPOTENCY_AUTO_KEY", "False").lower() == "true"
+
+    # ---------- Admin / profiling ----------
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")  # vazio desativa os endpoints de admin
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))  # fração de emissões (0 a 1)
+    PROFILING_DIR: str = os.getenv("PROFILING_DIR", "profiles")
+    PROFILING_TOP_FUNCTIONS: int = int(os.getenv("PROFILING_TOP_FUNCTIONS", "40"))
+
+    # ---------- Consultas ----------
+    STATUS_BATCH_MAX_UUIDS: int = int(os.getenv("STATUS_BATCH_MAX_UUIDS", "500"))
 
     # ---------- Diretórios ----------
     DOWNLOAD_DIR: str = os.getenv("DOWNLOAD_DIR", "downloads")
@@ -1,11 +1,22 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import JSONResponse, ORJSONResponse, FileResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Optional, List
+from datetime import datetime, timedelta, timezone
+import hmac
 import logging
+import os
 import uvicorn
-from services.nfse_service import NFSeService
-from services.database_service import DatabaseService
+from services.idempotency import IdempotencyConflictError, key_from_header, key_from_payload
+from services.profiling import ProfilingController, mark
+from services.retry_policy import NFSeErrorCode, RetryPolicy
+from config.settings import settings
+
+if TYPE_CHECKING:
+    from services.nfse_service import NFSeService
+    from services.database_service import DatabaseService
 
 
 # Force o Python a usar o WindowsSelectorEventLoopPolicy
@@ -20,11 +31,96 @@ if sys.platform.startswith("win"):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Serviços (criados no lifespan)
+nfse_service: Optional["NFSeService"] = None
+db_service: Optional["DatabaseService"] = None
+retry_policy = RetryPolicy()
+profiler = ProfilingController()
+
+# Estado de prontidão exposto em /ready
+readiness = {"ready": False, "error": None}
+
+# UUIDs com emissão em andamento neste processo (não são reconciliados)
+active_emissions: set = set()
+
+
+async def warmup_services():
+    """
+    Prepara o que o primeiro request precisaria pagar: schema, pool do banco,
+    Playwright (e opcionalmente Chromium/boto3). Roda em segundo plano para o
+    processo começar a responder /health imediatamente.
+
+    Falhas (banco ainda inacessível no boot, Chromium lento) são repetidas com
+    backoff exponencial até dar certo; enquanto isso /ready responde 503.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await asyncio.to_thread(db_service.ensure_schema)
+            await asyncio.to_thread(db_service.warmup)
+            await nfse_service.warmup()
+            readiness["ready"] = True
+            readiness["error"] = None
+            logger.info("Serviços aquecidos; API pronta para receber tráfego")
+            return
+        except Exception as e:
+            delay = min(settings.WARMUP_RETRY_MAX_DELAY, settings.WARMUP_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            readiness["error"] = f"{str(e)} (tentativa {attempt}; nova tentativa em {delay:.1f}s)"
+            logger.error(f"Erro no aquecimento dos serviços (tentativa {attempt}): {str(e)}; nova tentativa em {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def reconcile_stale_emissions():
+    """
+    Periodicamente renova o `updated_at` das emissões em andamento neste processo
+    (inclusive as que esperam na fila do limitador ou do navegador) e move para
+    DEAD_LETTER as NFSes em PROCESSING/RETRYING que nenhum processo renovou dentro de
+    `NFSE_STALE_AFTER_SECONDS`: a tarefa em background morreu com o processo
+    (reinício, deploy) e, sem a senha do emissor, não há como retomá-la.
+    """
+    while True:
+        await asyncio.sleep(settings.NFSE_RECONCILE_INTERVAL)
+        try:
+            active = set(active_emissions)
+            await db_service.run_async(db_service.touch_nfses, active)
+            cutoff = datetime.utcnow() - timedelta(seconds=settings.NFSE_STALE_AFTER_SECONDS)
+            await db_service.run_async(db_service.dead_letter_stale, cutoff, active)
+        except Exception as e:
+            logger.error(f"Erro ao reconciliar NFSes interrompidas: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Inicializa os serviços na subida do processo e libera recursos no encerramento
+    """
+    global nfse_service, db_service
+
+    # Importações tardias: SQLAlchemy/Playwright só carregam quando o app sobe
+    from services.nfse_service import NFSeService
+    from services.database_service import DatabaseService
+
+    db_service = DatabaseService()
+    nfse_service = NFSeService()
+    warmup_task = asyncio.create_task(warmup_services())
+    reconcile_task = asyncio.create_task(reconcile_stale_emissions())
+    try:
+        yield
+    finally:
+        readiness["ready"] = False
+        warmup_task.cancel()
+        reconcile_task.cancel()
+        await nfse_service.close()
+        db_service.dispose()
+
+
 # Criar instância do FastAPI
 app = FastAPI(
     title="NFSe API Headless",
     description="API para emissão de NFSe em segundo plano usando web scraping headless",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para permitir requisições de qualquer origem
@@ -54,18 +150,69 @@ class NFSeResponse(BaseModel):
     success: bool
     message: str
     uuid: Optional[str] = None
+    status: Optional[str] = None
     numero_nfse: Optional[str] = None
     pdf_url: Optional[str] = None
     xml_url: Optional[str] = None
 
+class NFSeStatusRequest(BaseModel):
+    uuids: List[str]
+    changed_since: Optional[datetime] = None  # só devolve notas com updated_at posterior
+
+class NFSeData(BaseModel):
+    # Todos opcionais: com `fields=` só as colunas pedidas são devolvidas
+    id: Optional[int] = None
+    uuid: Optional[str] = None
+    cnpj: Optional[str] = None
+    date: Optional[str] = None  # formato: DD/MM/YYYY
+    client_cnpj: Optional[str] = None
+    client_phone: Optional[str] = None
+    client_email: Optional[str] = None
+    invoice_value: Optional[float] = None
+    cnae_code: Optional[str] = None
+    cnae_service: Optional[str] = None
+    city: Optional[str] = None
+    invoice_description: Optional[str] = None
+    numero_nfse: Optional[str] = None
+    pdf_url: Optional[str] = None
+    xml_url: Optional[str] = None
+    status: Optional[str] = None
+    attempts: Optional[int] = None
+    error_code: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class NFSeDetailResponse(BaseModel):
+    success: bool
+    data: NFSeData
+
+class Pagination(BaseModel):
+    limit: int
+    offset: int
+
+class NFSeListResponse(BaseModel):
+    success: bool
+    data: List[NFSeData]
+    pagination: Pagination
+
+class LogData(BaseModel):
+    id: int
+    invoice_id: str
+    status: str
+    reason: Optional[str] = None
+    created_at: datetime
+
+class LogListResponse(BaseModel):
+    success: bool
+    data: List[LogData]
+
+class ProfilingConfig(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)  # fração das emissões amostradas
+
 class StatusResponse(BaseModel):
     status: str
     message: str
 
-# Instanciar serviços
-nfse_service = NFSeService()
-db_service = DatabaseService()
-
 @app.get("/", response_model=StatusResponse)
 async def root():
     """
@@ -86,20 +233,119 @@ async def health_check():
         message="API está saudável e operacional"
     )
 
+@app.get("/ready", response_model=StatusResponse)
+async def readiness_check():
+    """
+    Endpoint de readiness: só responde 200 depois do aquecimento e com o banco acessível
+    """
+    if not readiness["ready"]:
+        detail = readiness["error"] or "Aquecimento em andamento"
+        return JSONResponse(
+            status_code=503,
+            content=StatusResponse(status="starting", message=detail).model_dump()
+        )
+
+    if not await asyncio.to_thread(db_service.ping):
+        return JSONResponse(
+            status_code=503,
+            content=StatusResponse(status="unavailable", message="Banco de dados indisponível").model_dump()
+        )
+
+    return StatusResponse(
+        status="ready",
+        message="API pronta para receber tráfego"
+    )
+
+def require_admin(x_admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """
+    Dependência dos endpoints de admin: exige `X-Admin-Token` igual a `ADMIN_TOKEN`
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints de admin desativados (ADMIN_TOKEN vazio)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de admin inválido")
+
+@app.get("/api/admin/profiling", response_model=ProfilingConfig, dependencies=[Depends(require_admin)])
+async def get_profiling_config():
+    """
+    Endpoint para consultar a taxa de amostragem do profiling
+    """
+    return ProfilingConfig(sample_rate=profiler.sample_rate)
+
+@app.put("/api/admin/profiling", response_model=ProfilingConfig, dependencies=[Depends(require_admin)])
+async def set_profiling_config(config: ProfilingConfig):
+    """
+    Endpoint para ligar/desligar o profiling (0 desliga, 1 amostra todas as emissões)
+    """
+    profiler.sample_rate = config.sample_rate
+    logger.info(f"Taxa de amostragem do profiling alterada para {config.sample_rate}")
+    return ProfilingConfig(sample_rate=profiler.sample_rate)
+
+@app.get("/api/concurrency", response_model=dict)
+async def get_concurrency():
+    """
+    Endpoint para inspecionar o limite adaptativo de emissões simultâneas
+    """
+    return {
+        "success": True,
+        "data": nfse_service.limiter.snapshot()
+    }
+
+@app.get("/api/browser", response_model=dict)
+async def get_browser_stats():
+    """
+    Endpoint para inspecionar memória, contextos e páginas abertas do Chromium
+    """
+    return {
+        "success": True,
+        "data": nfse_service.browser_manager.snapshot()
+    }
+
 @app.post("/api/emitir-nfse", response_model=NFSeResponse)
-async def emitir_nfse(request: NFSeRequest, background_tasks: BackgroundTasks):
+async def emitir_nfse(
+    request: NFSeRequest,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+):
     """
-    Endpoint principal para emissão de NFSe
+    Endpoint principal para emissão de NFSe.
+
+    Repetições com o mesmo `Idempotency-Key` (ou, com `IDEMPOTENCY_AUTO_KEY`, com o
+    mesmo payload) dentro da janela devolvem a emissão já existente sem criar outra,
+    salvo se ela terminou em ERROR/DEAD_LETTER: aí uma nova emissão é iniciada.
+    Reusar um `Idempotency-Key` com outro payload devolve 422.
     """
     try:
         logger.info(f"Recebida requisição de emissão para CNPJ: {request.cnpj_emissor}")
         
         # Converter request para dict
         data = request.model_dump()
+
+        fingerprint = None
+        if idempotency_key:
+            stored_key = key_from_header(idempotency_key, request.cnpj_emissor)
+            fingerprint = key_from_payload(data)
+        elif settings.IDEMPOTENCY_AUTO_KEY:
+            stored_key = key_from_payload(data)
+        else:
+            stored_key = None
         
         # Criar registro no banco de dados
-        nfse_record = db_service.create_nfse(data)
-        db_service.create_log(nfse_record["uuid"], "PROCESSING", "Iniciando emissão")
+        nfse_record = await db_service.run_async(
+            db_service.create_nfse, data, idempotency_key=stored_key, fingerprint=fingerprint
+        )
+
+        if not nfse_record["created"]:
+            response.headers["Idempotent-Replayed"] = "true"
+            return NFSeResponse(
+                success=True,
+                message="Requisição repetida; a emissão já existe. Verifique o status usando o UUID fornecido.",
+                uuid=nfse_record["uuid"],
+                status=nfse_record["status"]
+            )
+
+        await db_service.run_async(db_service.create_log, nfse_record["uuid"], "PROCESSING", "Iniciando emissão")
         
         # Executar emissão em background
         background_tasks.add_task(
@@ -111,30 +357,78 @@ async def emitir_nfse(request: NFSeRequest, background_tasks: BackgroundTasks):
         return NFSeResponse(
             success=True,
             message="Emissão de NFSe iniciada. Verifique o status usando o UUID fornecido.",
-            uuid=nfse_record["uuid"]
+            uuid=nfse_record["uuid"],
+            status=nfse_record["status"]
         )
         
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Erro na requisição de emissão: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
 
-@app.get("/api/nfse/{uuid}", response_model=dict)
-async def get_nfse(uuid: str):
+@app.post("/api/nfse/status", response_model=dict)
+async def get_nfse_statuses(request: NFSeStatusRequest):
     """
-    Endpoint para consultar uma NFSe pelo UUID
+    Endpoint para consultar o status de várias NFSes em uma única requisição
     """
-    logger.info(f"🔍 Buscando no banco de dados MySQL o UUID: {uuid}")
+    if len(request.uuids) > settings.STATUS_BATCH_MAX_UUIDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Máximo de {settings.STATUS_BATCH_MAX_UUIDS} UUIDs por requisição"
+        )
+
+    changed_since = request.changed_since
+    if changed_since is not None and changed_since.tzinfo is not None:
+        # updated_at é gravado sem fuso (UTC)
+        changed_since = changed_since.astimezone(timezone.utc).replace(tzinfo=None)
 
     try:
-        nfse = db_service.get_nfse(uuid)
+        statuses = await db_service.run_async(
+            db_service.get_nfse_statuses, list(dict.fromkeys(request.uuids)), changed_since
+        )
+        return {
+            "success": True,
+            "data": statuses
+        }
+
+    except Exception as e:
+        logger.error(f"Erro ao buscar status em lote: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+def parse_fields(fields: Optional[str], allowed) -> Optional[List[str]]:
+    """
+    Converte `fields=a,b,c` em lista de colunas, validando contra `allowed`
+    """
+    if not fields:
+        return None
+
+    requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(unknown)}")
+    return requested or None
+
+# As rotas de leitura devolvem ORJSONResponse diretamente: o response_model
+# documenta o contrato, mas a validação/serialização do FastAPI é pulada.
+@app.get("/api/nfse/{uuid}", response_model=NFSeDetailResponse, response_class=ORJSONResponse)
+async def get_nfse(uuid: str, fields: Optional[str] = None):
+    """
+    Endpoint para consultar uma NFSe pelo UUID (`fields=` limita as colunas devolvidas)
+    """
+    logger.info(f"🔍 Buscando no banco de dados o UUID: {uuid}")
+    selected = parse_fields(fields, db_service.INVOICE_FIELDS)
+
+    try:
+        nfse = await db_service.run_async(db_service.get_nfse, uuid, fields=selected)
         if not nfse:
             raise HTTPException(status_code=404, detail="NFSe não encontrada")
         
-        return {
+        return ORJSONResponse({
             "success": True,
             "data": nfse
-        }
+        })
         
     except HTTPException:
         raise
@@ -142,77 +436,190 @@ async def get_nfse(uuid: str):
         logger.error(f"Erro ao buscar NFSe: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
-@app.get("/api/nfse/{uuid}/logs", response_model=dict)
+@app.get("/api/nfse/{uuid}/logs", response_model=LogListResponse, response_class=ORJSONResponse)
 async def get_nfse_logs(uuid: str):
     """
     Endpoint para buscar logs de uma NFSe
     """
     try:
-        logs = db_service.get_logs(uuid)
-        return {
+        logs = await db_service.run_async(db_service.get_logs, uuid)
+        return ORJSONResponse({
             "success": True,
             "data": logs
-        }
+        })
         
     except Exception as e:
         logger.error(f"Erro ao buscar logs: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
-@app.get("/api/nfses", response_model=dict)
-async def list_nfses(limit: int = 50, offset: int = 0, status: Optional[str] = None):
+@app.get("/api/nfses", response_model=NFSeListResponse, response_class=ORJSONResponse)
+async def list_nfses(limit: int = 50, offset: int = 0, status: Optional[str] = None, fields: Optional[str] = None):
     """
-    Endpoint para listar NFSes com paginação e filtros
+    Endpoint para listar NFSes com paginação e filtros (`fields=` limita as colunas devolvidas)
     """
+    selected = parse_fields(fields, db_service.INVOICE_FIELDS)
+
     try:
-        nfses = db_service.list_nfses(limit=limit, offset=offset, status=status)
+        nfses = await db_service.run_async(
+            db_service.list_nfses, limit=limit, offset=offset, status=status, fields=selected
+        )
         
-        return {
+        return ORJSONResponse({
             "success": True,
             "data": nfses,
             "pagination": {
                 "limit": limit,
                 "offset": offset
             }
-        }
+        })
         
     except Exception as e:
         logger.error(f"Erro ao listar NFSes: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
+@app.get("/api/nfse/{uuid}/profile", response_model=dict, response_class=ORJSONResponse,
+         dependencies=[Depends(require_admin)])
+async def get_nfse_profile(uuid: str):
+    """
+    Endpoint para buscar os perfis das emissões amostradas de uma NFSe
+    """
+    try:
+        profiles = await db_service.run_async(db_service.get_profiles, uuid)
+        return ORJSONResponse({
+            "success": True,
+            "data": profiles
+        })
+
+    except Exception as e:
+        logger.error(f"Erro ao buscar perfis: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
+
+@app.get("/api/nfse/{uuid}/profile/trace/{number}", dependencies=[Depends(require_admin)])
+async def get_nfse_trace(uuid: str, number: int):
+    """
+    Endpoint para baixar um trace do Playwright (abra com `playwright show-trace`)
+    """
+    profiles = await db_service.run_async(db_service.get_profiles, uuid)
+    traces = [path for profile in profiles for path in profile["trace_paths"]]
+    expected = f"trace-{number}.zip"
+    path = next((p for p in traces if os.path.basename(p) == expected), None)
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Trace não encontrado")
+    return FileResponse(path, media_type="application/zip", filename=f"{uuid}-{expected}")
+
 async def process_nfse_emission(uuid: str, data: dict):
     """
-    Função para processar a emissão de NFSe em background
+    Função para processar a emissão de NFSe em background.
+
+    Uma fração das emissões (`profiler.sample_rate`) é amostrada: roda sob o
+    `EmissionProfile` e o resultado é gravado em `invoice_profiles`. As demais não
+    pagam nada além do sorteio.
     """
+    active_emissions.add(uuid)
     try:
-        logger.info(f"Iniciando processamento da NFSe {uuid}")
-        
-        # Emitir a NFSe usando o serviço
-        result = await nfse_service.emitir_nfse(data)
-        
-        if result["success"]:
-            # Atualizar registro com sucesso
-            db_service.update_nfse(uuid, {
-                "numero_nfse": result.get("numero_nfse"),
-                "pdf_url": result.get("pdf_path"),
-                "xml_url": result.get("xml_path"),
-                "status": "SUCCESS"
-            })
-            db_service.create_log(uuid, "SUCCESS", "NFSe emitida com sucesso")
-            logger.info(f"NFSe {uuid} emitida com sucesso")
-        else:
+        profile = profiler.start(uuid)
+        if profile is None:
+            await run_nfse_emission(uuid, data)
+            return
+
+        with profile:
+            await run_nfse_emission(uuid, data)
+
+        try:
+            await db_service.run_async(db_service.save_profile, uuid, profile.to_dict())
+        except Exception as e:
+            logger.error(f"Erro ao gravar perfil da NFSe {uuid}: {str(e)}")
+    finally:
+        active_emissions.discard(uuid)
+
+async def update_in_flight(uuid: str, updates: dict) -> bool:
+    """
+    Grava o resultado de uma tentativa só se a NFSe ainda estiver em andamento.
+    Devolve False se ela já saiu de PROCESSING/RETRYING (p.ex. foi para DEAD_LETTER
+    pelo reconciliador).
+    """
+    return await db_service.run_async(
+        db_service.update_nfse, uuid, updates, only_statuses=db_service.IN_FLIGHT_STATUSES
+    )
+
+async def run_nfse_emission(uuid: str, data: dict):
+    """
+    Executa a emissão com novas tentativas.
+
+    Falhas transitórias (ver ``RetryPolicy``) são repetidas com backoff exponencial;
+    esgotadas as tentativas, a nota vai para ``DEAD_LETTER``. Falhas definitivas
+    (autenticação, validação, download após envio) marcam ``ERROR`` de imediato.
+
+    Se a NFSe foi movida para DEAD_LETTER pelo reconciliador durante a emissão, as
+    novas tentativas param e falhas não sobrescrevem o status; um sucesso é gravado
+    mesmo assim (a nota existe no portal), com aviso no log.
+    """
+    attempts = 0
+    while True:
+        try:
+            attempts = await db_service.run_async(db_service.increment_attempts, uuid)
+            logger.info(f"Iniciando processamento da NFSe {uuid} (tentativa {attempts})")
+
+            # Emitir a NFSe usando o serviço
+            result = await nfse_service.emitir_nfse(data)
+        except Exception as e:
+            logger.error(f"Erro no processamento da NFSe {uuid}: {str(e)}")
+            result = {
+                "success": False,
+                "message": f"Erro no processamento: {str(e)}",
+                "error_code": NFSeErrorCode.UNKNOWN,
+            }
+
+        try:
+            if result["success"]:
+                # Atualizar registro com sucesso
+                success = {
+                    "numero_nfse": result.get("numero_nfse"),
+                    "pdf_url": result.get("pdf_path"),
+                    "xml_url": result.get("xml_path"),
+                    "status": "SUCCESS",
+                    "error_code": None,
+                }
+                if not await update_in_flight(uuid, success):
+                    await db_service.run_async(db_service.update_nfse, uuid, success)
+                    logger.warning(f"NFSe {uuid} emitida depois de ter saído de PROCESSING/RETRYING")
+                    await db_service.run_async(
+                        db_service.create_log, uuid, "SUCCESS",
+                        "NFSe emitida após ter sido dada como interrompida; desconsidere o DEAD_LETTER anterior"
+                    )
+                    return
+                await db_service.run_async(db_service.create_log, uuid, "SUCCESS", "NFSe emitida com sucesso")
+                logger.info(f"NFSe {uuid} emitida com sucesso")
+                return
+
+            error_code = result.get("error_code") or NFSeErrorCode.UNKNOWN
+
+            if retry_policy.should_retry(error_code, attempts):
+                delay = retry_policy.next_delay(attempts)
+                if not await update_in_flight(uuid, {"status": "RETRYING", "error_code": error_code}):
+                    logger.warning(f"NFSe {uuid} não está mais em andamento; novas tentativas canceladas")
+                    return
+                await db_service.run_async(
+                    db_service.create_log, uuid, "RETRYING",
+                    f"[{error_code}] {result.get('message')} — nova tentativa em {delay:.1f}s"
+                )
+                logger.warning(f"Falha transitória na NFSe {uuid} ({error_code}); nova tentativa em {delay:.1f}s")
+                mark("backoff")
+                await asyncio.sleep(delay)
+                continue
+
             # Atualizar registro com erro
-            db_service.update_nfse(uuid, {
-                "status": "ERROR"
-            })
-            db_service.create_log(uuid, "ERROR", result.get("message"))
-            logger.error(f"Erro na emissão da NFSe {uuid}: {result.get('message')}")
-            
-    except Exception as e:
-        logger.error(f"Erro no processamento da NFSe {uuid}: {str(e)}")
-        db_service.update_nfse(uuid, {
-            "status": "ERROR"
-        })
-        db_service.create_log(uuid, "ERROR", f"Erro no processamento: {str(e)}")
+            status = "DEAD_LETTER" if retry_policy.is_retryable(error_code) else "ERROR"
+            if not await update_in_flight(uuid, {"status": status, "error_code": error_code}):
+                logger.warning(f"NFSe {uuid} não está mais em andamento; resultado {status} descartado")
+                return
+            await db_service.run_async(db_service.create_log, uuid, status, f"[{error_code}] {result.get('message')}")
+            logger.error(f"Erro na emissão da NFSe {uuid} ({error_code}): {result.get('message')}")
+            return
+
+        except Exception as e:
+            logger.error(f"Erro ao registrar resultado da NFSe {uuid}: {str(e)}")
+            return
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Float, Text
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, Text, text
 from datetime import datetime, timezone
 from models.base import Base  # IMPORTA base única
 
@@ -21,5 +21,9 @@ class Invoice(Base):
     pdf_url = Column(String)
     xml_url = Column(String)
     status = Column(String)
+    attempts = Column(Integer, default=0, server_default=text("0"), nullable=False)
+    error_code = Column(String)
+    idempotency_key = Column(String(64), unique=True, index=True)
+    idempotency_fingerprint = Column(String(64))  # hash do payload enviado com a chave
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from datetime import datetime
+from models.base import Base  # IMPORTA base única
+
+class InvoiceProfile(Base):
+    __tablename__ = 'invoice_profiles'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    invoice_id = Column(String, ForeignKey('invoices.uuid'), nullable=False, index=True)
+    total_ms = Column(Integer)
+    timeline = Column(Text)      # JSON: etapas do emitir_nfse
+    db_calls = Column(Text)      # JSON: tempo/contagem por método do DatabaseService
+    cpu_profile = Column(Text)   # saída do pstats (funções mais custosas)
+    trace_paths = Column(Text)   # JSON: arquivos de trace do Playwright
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
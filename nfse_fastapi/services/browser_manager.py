@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional
+
+from config.settings import settings
+
+if TYPE_CHECKING:
+    from playwright.async_api import Browser, BrowserContext, Playwright
+
+logger = logging.getLogger(__name__)
+
+# Argumentos de lançamento do Chromium usados em todas as emissões
+CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-web-security",
+    "--disable-features=VizDisplayCompositor",
+]
+
+_RSS_CACHE_SECONDS = 1.0
+# Navegadores mais novos que isso não são reciclados por memória (evita reciclar em laço)
+_MIN_RECYCLE_AGE_SECONDS = 60.0
+
+
+def _descendant_rss_bytes() -> Optional[int]:
+    """
+    Soma o RSS de todos os processos filhos (driver do Playwright + Chromium).
+    Usa psutil se instalado; senão lê /proc. Devolve None se não houver como medir.
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        total = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+
+    if not os.path.isdir("/proc"):
+        return None
+
+    parents: Dict[int, int] = {}
+    rss_pages: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                statm = f.read().split()
+        except OSError:
+            continue
+        # O nome do processo (campo 2) pode conter espaços: o ppid vem depois do ")"
+        pid = int(entry)
+        parents[pid] = int(stat.rsplit(")", 1)[1].split()[1])
+        rss_pages[pid] = int(statm[1])
+
+    descendants = {os.getpid()}
+    changed = True
+    while changed:
+        changed = False
+        for pid, ppid in parents.items():
+            if ppid in descendants and pid not in descendants:
+                descendants.add(pid)
+                changed = True
+    descendants.discard(os.getpid())
+    return sum(rss_pages.get(pid, 0) for pid in descendants) * os.sysconf("SC_PAGE_SIZE")
+
+
+class _BrowserHandle:
+    """Um processo Chromium e os contextos abertos nele."""
+
+    def __init__(self, browser: "Browser") -> None:
+        self.browser = browser
+        self.launched_at = time.monotonic()
+        self.contexts: List["BrowserContext"] = []
+        self.pending = 0  # contextos sendo abertos neste navegador
+        self.draining = False
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.launched_at
+
+
+class BrowserManager:
+    """
+    Mantém um Chromium compartilhado entre as emissões e governa sua memória.
+
+    Cada emissão recebe um ``BrowserContext`` próprio. Novos contextos só são
+    abertos se houver vaga em ``max_contexts`` (limitado também por
+    ``memory_budget_mb / context_memory_mb``) e se o RSS medido dos processos do
+    navegador ainda comportar mais um contexto; caso contrário a emissão espera na
+    fila. Quando o RSS passa de ``recycle_rss_mb`` ou o navegador fica mais velho
+    que ``max_age``, ele é marcado para reciclagem: novas emissões vão para um
+    Chromium novo e o antigo é fechado assim que seus contextos terminam.
+    """
+
+    def __init__(
+        self,
+        max_contexts: Optional[int] = None,
+        memory_budget_mb: Optional[int] = None,
+        context_memory_mb: Optional[int] = None,
+        recycle_rss_mb: Optional[int] = None,
+        max_age: Optional[float] = None,
+    ) -> None:
+        self.memory_budget_mb = memory_budget_mb if memory_budget_mb is not None else settings.BROWSER_MEMORY_BUDGET_MB
+        self.context_memory_mb = context_memory_mb if context_memory_mb is not None else settings.BROWSER_CONTEXT_MEMORY_MB
+        configured = max_contexts if max_contexts is not None else settings.BROWSER_MAX_CONTEXTS
+        self.max_contexts = max(1, min(configured, self.memory_budget_mb // max(self.context_memory_mb, 1)))
+        self.recycle_rss_mb = recycle_rss_mb if recycle_rss_mb is not None else settings.BROWSER_RECYCLE_RSS_MB
+        self.max_age = max_age if max_age is not None else settings.BROWSER_MAX_AGE_SECONDS
+
+        self._playwright: Optional["Playwright"] = None
+        self._current: Optional[_BrowserHandle] = None
+        self._draining: List[_BrowserHandle] = []
+        self._open_contexts = 0
+        self._waiting = 0
+        self._recycled = 0
+        self._rss_cache: Optional[int] = None
+        self._rss_cached_at = 0.0
+        # `_condition` guarda só a contagem de vagas; lançar e reciclar o Chromium
+        # é serializado por `_launch_lock`, sem bloquear quem está liberando vagas
+        self._condition = asyncio.Condition()
+        self._launch_lock = asyncio.Lock()
+
+    # ------------------------------------------------------------------ memória
+    def rss_mb(self) -> Optional[float]:
+        """RSS atual (MB) do driver do Playwright e dos processos do Chromium."""
+        now = time.monotonic()
+        if self._rss_cache is None or now - self._rss_cached_at > _RSS_CACHE_SECONDS:
+            self._rss_cache = _descendant_rss_bytes()
+            self._rss_cached_at = now
+        return None if self._rss_cache is None else self._rss_cache / (1024 * 1024)
+
+    def _has_capacity(self) -> bool:
+        if self._open_contexts == 0:
+            return True  # sempre deixa ao menos uma emissão andar
+        if self._open_contexts >= self.max_contexts:
+            return False
+        rss = self.rss_mb()
+        return rss is None or rss + self.context_memory_mb <= self.memory_budget_mb
+
+    def _needs_recycle(self, handle: _BrowserHandle) -> bool:
+        if self.max_age and handle.age > self.max_age:
+            return True
+        if self._draining or handle.age < _MIN_RECYCLE_AGE_SECONDS:
+            return False  # o RSS ainda inclui o navegador anterior em reciclagem
+        rss = self.rss_mb()
+        return bool(self.recycle_rss_mb) and rss is not None and rss > self.recycle_rss_mb
+
+    # ---------------------------------------------------------------- navegador
+    async def start(self) -> None:
+        """Inicia o Playwright e o Chromium (usado no warmup)."""
+        async with self._launch_lock:
+            await self._ensure_browser()
+
+    async def _ensure_browser(self) -> _BrowserHandle:
+        if self._current is not None and self._needs_recycle(self._current):
+            logger.info(
+                "Reciclando Chromium (idade %.0fs, RSS %s MB)",
+                self._current.age, f"{self.rss_mb():.0f}" if self.rss_mb() is not None else "?",
+            )
+            self._current.draining = True
+            self._draining.append(self._current)
+            self._current = None
+            self._recycled += 1
+            await self._close_drained()
+
+        if self._current is None or not self._current.browser.is_connected():
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+
+                self._playwright = await async_playwright().start()
+            browser = await self._playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+            self._current = _BrowserHandle(browser)
+            self._rss_cache = None
+        return self._current
+
+    async def _close_drained(self) -> None:
+        # Separa os navegadores antes do primeiro await: chamadas concorrentes não
+        # tentam fechar o mesmo navegador, e não é preciso segurar `_launch_lock`
+        closable = [h for h in self._draining if not h.contexts and not h.pending]
+        self._draining = [h for h in self._draining if h not in closable]
+        for handle in closable:
+            try:
+                await handle.browser.close()
+            except Exception as e:
+                logger.warning("Erro ao fechar Chromium reciclado: %s", e)
+        self._rss_cache = None
+
+    @asynccontextmanager
+    async def new_context(self, **kwargs: Any) -> AsyncIterator["BrowserContext"]:
+        """
+        Aguarda vaga no orçamento de memória e abre um contexto isolado para a emissão.
+        O contexto é fechado ao sair do bloco.
+        """
+        async with self._condition:
+            self._waiting += 1
+            try:
+                await self._condition.wait_for(self._has_capacity)
+            finally:
+                self._waiting -= 1
+            self._open_contexts += 1  # reserva a vaga; o navegador é aberto fora do lock
+
+        handle: Optional[_BrowserHandle] = None
+        try:
+            async with self._launch_lock:
+                handle = await self._ensure_browser()
+                handle.pending += 1
+            try:
+                context = await handle.browser.new_context(**kwargs)
+            finally:
+                handle.pending -= 1
+            handle.contexts.append(context)
+        except BaseException:
+            await self._release_slot(handle)
+            raise
+
+        try:
+            yield context
+        finally:
+            try:
+                await context.close()
+            except Exception as e:
+                logger.warning("Erro ao fechar contexto do navegador: %s", e)
+            handle.contexts.remove(context)
+            await self._release_slot(handle)
+
+    async def _release_slot(self, handle: Optional[_BrowserHandle]) -> None:
+        async with self._condition:
+            self._open_contexts -= 1
+            self._rss_cache = None
+            self._condition.notify_all()
+        if handle is not None and handle.draining:
+            await self._close_drained()
+
+    async def close(self) -> None:
+        async with self._launch_lock:
+            handles = self._draining + ([self._current] if self._current else [])
+            self._draining, self._current = [], None
+            for handle in handles:
+                try:
+                    await handle.browser.close()
+                except Exception as e:
+                    logger.warning("Erro ao fechar Chromium: %s", e)
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado atual do navegador, para inspeção."""
+        handles = self._draining + ([self._current] if self._current else [])
+        rss = self.rss_mb()
+        return {
+            "browsers": len(handles),
+            "draining": len(self._draining),
+            "open_contexts": self._open_contexts,
+            "open_pages": sum(len(ctx.pages) for h in handles for ctx in h.contexts),
+            "waiting": self._waiting,
+            "max_contexts": self.max_contexts,
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "memory_budget_mb": self.memory_budget_mb,
+            "recycle_rss_mb": self.recycle_rss_mb,
+            "browser_age_seconds": round(self._current.age, 1) if self._current else None,
+            "max_age_seconds": self.max_age,
+            "recycled": self._recycled,
+        }
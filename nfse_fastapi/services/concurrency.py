@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    Limitador de concorrência AIMD (aumento aditivo / redução multiplicativa).
+
+    Cada emissão saudável (sem sinal de congestionamento e com latência abaixo do
+    alvo) que ocupou a última vaga soma ``1 / limite`` ao limite — ou seja, +1 a
+    cada "janela" de emissões. Com vagas sobrando o limite não cresce: não há
+    evidência de que o portal aguente mais do que a carga atual.
+    Um timeout do portal ou uma emissão lenta multiplica o limite por
+    ``decrease_factor``, no máximo uma vez por janela para não desabar em rajadas.
+    O limite fica sempre entre ``min_limit`` e ``max_limit``; opcionalmente cada
+    emissor (CNPJ) tem um teto próprio de emissões simultâneas.
+    """
+
+    def __init__(
+        self,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        initial_limit: Optional[int] = None,
+        latency_target: Optional[float] = None,
+        decrease_factor: Optional[float] = None,
+        per_emitter_limit: Optional[int] = None,
+    ) -> None:
+        self.min_limit = max(1, min_limit if min_limit is not None else settings.NFSE_CONCURRENCY_MIN)
+        self.max_limit = max(self.min_limit, max_limit if max_limit is not None else settings.NFSE_CONCURRENCY_MAX)
+        initial = initial_limit if initial_limit is not None else settings.NFSE_CONCURRENCY_INITIAL
+        self.latency_target = latency_target if latency_target is not None else settings.NFSE_CONCURRENCY_LATENCY_TARGET
+        self.decrease_factor = decrease_factor if decrease_factor is not None else settings.NFSE_CONCURRENCY_DECREASE_FACTOR
+        # 0 desativa o teto por emissor
+        self.per_emitter_limit = per_emitter_limit if per_emitter_limit is not None else settings.NFSE_CONCURRENCY_PER_EMITTER
+
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._in_flight_by_emitter: Dict[str, int] = {}
+        self._waiting = 0
+        self._last_decrease = 0.0
+        self._successes = 0
+        self._failures = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Limite atual de emissões simultâneas."""
+        return int(self._limit)
+
+    def _has_capacity(self, emitter: Optional[str]) -> bool:
+        if self._in_flight >= self.limit:
+            return False
+        if emitter and self.per_emitter_limit > 0:
+            return self._in_flight_by_emitter.get(emitter, 0) < self.per_emitter_limit
+        return True
+
+    @asynccontextmanager
+    async def acquire(self, emitter: Optional[str] = None) -> AsyncIterator["_Permit"]:
+        """
+        Aguarda uma vaga e a mantém enquanto o bloco executa.
+
+        O chamador informa o resultado via ``permit.record(...)``; se não o fizer,
+        a vaga é liberada sem alterar o limite. A latência é medida a partir de
+        ``permit.start_clock()`` (ou da concessão da vaga, se não for chamado), para
+        que esperas locais, como a fila do navegador, não contem como lentidão do portal.
+        """
+        async with self._condition:
+            self._waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self._has_capacity(emitter))
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+            if emitter:
+                self._in_flight_by_emitter[emitter] = self._in_flight_by_emitter.get(emitter, 0) + 1
+            saturated = self._in_flight >= self.limit
+
+        permit = _Permit(time.monotonic(), saturated)
+        try:
+            yield permit
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                if emitter:
+                    remaining = self._in_flight_by_emitter.get(emitter, 1) - 1
+                    if remaining > 0:
+                        self._in_flight_by_emitter[emitter] = remaining
+                    else:
+                        self._in_flight_by_emitter.pop(emitter, None)
+                if permit.congested is not None:
+                    self._update(permit.congested, time.monotonic() - permit.started_at, permit.saturated)
+                self._condition.notify_all()
+
+    def _update(self, congested: bool, latency: float, saturated: bool) -> None:
+        previous = self.limit
+        if congested or latency > self.latency_target:
+            self._failures += 1
+            now = time.monotonic()
+            # Uma redução por janela: reações a falhas da mesma rajada são ignoradas
+            if now - self._last_decrease >= self.latency_target:
+                self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                self._last_decrease = now
+        else:
+            self._successes += 1
+            if saturated:
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+
+        if self.limit != previous:
+            logger.info("Limite de concorrência ajustado: %s → %s (latência %.1fs)", previous, self.limit, latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado atual do limitador, para inspeção."""
+        return {
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "per_emitter_limit": self.per_emitter_limit,
+            "latency_target": self.latency_target,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "in_flight_by_emitter": dict(self._in_flight_by_emitter),
+            "successes": self._successes,
+            "failures": self._failures,
+        }
+
+
+class _Permit:
+    """Vaga concedida pelo ``AdaptiveLimiter``; guarda o sinal de saúde da emissão."""
+
+    __slots__ = ("started_at", "saturated", "congested")
+
+    def __init__(self, started_at: float, saturated: bool) -> None:
+        self.started_at = started_at
+        self.saturated = saturated  # a emissão ocupou a última vaga do limite
+        self.congested: Optional[bool] = None
+
+    def start_clock(self) -> None:
+        """Marca o início do trabalho no portal para o cálculo da latência."""
+        self.started_at = time.monotonic()
+
+    def record(self, congested: bool) -> None:
+        self.congested = congested
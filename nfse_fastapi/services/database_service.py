@@ -1,33 +1,176 @@
+import asyncio
+import contextvars
+import functools
+import json
 import logging
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import uuid
-from typing import Dict, Any, List, Optional
-import os
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
 from config.settings import settings
-from sqlalchemy import create_engine, text, desc
+from sqlalchemy import bindparam, create_engine, text, desc, select, inspect, or_, update
+from sqlalchemy.engine import Connection, make_url
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from models.base import Base
 from models.invoice import Invoice
 from models.log import Log
-
-load_dotenv()
+from models.profile import InvoiceProfile
+from services.idempotency import IdempotencyConflictError, releases_key
+from services.profiling import profiled
+from services.retry_policy import NFSeErrorCode
+from services.sqlite_writer import SQLiteWriteQueue, apply_sqlite_pragmas
 
 # Configurar logging
 
 logger = logging.getLogger(__name__)
 
 class DatabaseService:
-    def __init__(self):
-        self.database_url = settings.get_database_url()
+    # Colunas públicas devolvidas pelos endpoints de leitura (ordem da resposta)
+    INVOICE_FIELDS = (
+        "id", "uuid", "cnpj", "date", "client_cnpj", "client_phone", "client_email",
+        "invoice_value", "cnae_code", "cnae_service", "city", "invoice_description",
+        "numero_nfse", "pdf_url", "xml_url", "status", "attempts", "error_code",
+        "created_at", "updated_at",
+    )
+    LOG_FIELDS = ("id", "invoice_id", "status", "reason", "created_at")
+    # Status de uma NFSe cuja emissão ainda não terminou
+    IN_FLIGHT_STATUSES = ("PROCESSING", "RETRYING")
+
+    def __init__(self, database_url: Optional[str] = None, sqlite_production_mode: Optional[bool] = None):
+        self.database_url = database_url or settings.get_database_url()
         connect_args = {}
         if self.database_url.startswith("sqlite"):
             connect_args = {"check_same_thread": False}
 
         self.engine = create_engine(self.database_url, connect_args=connect_args, pool_pre_ping=True)
-        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False)
-        Base.metadata.create_all(self.engine)
+        self.read_engine = self.engine
+        self.write_queue: Optional[SQLiteWriteQueue] = None
+
+        if sqlite_production_mode is None:
+            sqlite_production_mode = settings.SQLITE_PRODUCTION_MODE
+        sqlite_path = make_url(self.database_url).database if self.database_url.startswith("sqlite") else None
+        if sqlite_production_mode and sqlite_path and sqlite_path != ":memory:":
+            # WAL + PRAGMAs, escritas serializadas numa thread e leituras num pool somente leitura
+            apply_sqlite_pragmas(self.engine)
+            with self.engine.connect():
+                pass  # cria o arquivo e ativa o WAL antes do pool somente leitura abrir conexões
+            self.read_engine = create_engine(
+                f"sqlite:///file:{sqlite_path}?mode=ro&uri=true",
+                connect_args=connect_args,
+                pool_size=settings.SQLITE_READ_POOL_SIZE,
+            )
+            apply_sqlite_pragmas(self.read_engine, read_only=True)
+            self.write_queue = SQLiteWriteQueue(self.engine)
+
+        # Sessões são usadas só para leitura; escritas passam por `run_write`
+        self.SessionLocal = sessionmaker(bind=self.read_engine, autocommit=False, autoflush=False)
+
+        # Threads para chamadas vindas de corrotinas (ver `run_async`)
+        self._executor = ThreadPoolExecutor(max_workers=settings.DB_ASYNC_WORKERS, thread_name_prefix="db")
+
+    def ensure_schema(self) -> bool:
+        """
+        Cria as tabelas que ainda não existem e adiciona às tabelas existentes as
+        colunas novas dos models. Não faz nada se `DB_AUTO_CREATE_SCHEMA` estiver
+        desligado. Devolve True se o schema foi alterado.
+        """
+        if not settings.DB_AUTO_CREATE_SCHEMA:
+            return False
+
+        inspector = inspect(self.engine)
+        existing = set(inspector.get_table_names())
+        changed = False
+
+        missing = [table for name, table in Base.metadata.tables.items() if name not in existing]
+        if missing:
+            Base.metadata.create_all(self.engine, tables=missing)
+            logger.info("Tabelas criadas: %s", ", ".join(table.name for table in missing))
+            changed = True
+
+        for table in Base.metadata.sorted_tables:
+            if table.name in existing:
+                changed = self._add_missing_columns(inspector, table) or changed
+                changed = self._create_missing_indexes(inspector, table) or changed
+        return changed
+
+    def _add_missing_columns(self, inspector, table) -> bool:
+        """
+        `ALTER TABLE ... ADD COLUMN` para as colunas do model que faltam no banco
+        (bancos criados antes delas existirem). Colunas NOT NULL precisam de
+        `server_default` para preencher as linhas antigas.
+        """
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in present]
+        if not missing:
+            return False
+
+        dialect = self.engine.dialect
+        preparer = dialect.identifier_preparer
+        with self.engine.begin() as conn:
+            for column in missing:
+                ddl = (
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+                )
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg.text}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+        logger.info("Colunas adicionadas em %s: %s", table.name, ", ".join(column.name for column in missing))
+        return True
+
+    def _create_missing_indexes(self, inspector, table) -> bool:
+        """
+        Cria os índices do model que faltam no banco, como o índice único de
+        `idempotency_key` em tabelas criadas antes da coluna.
+        """
+        present = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing = [index for index in table.indexes if index.name not in present]
+        if not missing:
+            return False
+
+        with self.engine.begin() as conn:
+            for index in missing:
+                index.create(conn)
+        logger.info("Índices criados em %s: %s", table.name, ", ".join(index.name for index in missing))
+        return True
+
+    def warmup(self, connections: Optional[int] = None) -> None:
+        """
+        Abre `connections` conexões do pool antes do primeiro request.
+        """
+        connections = settings.DB_PREWARM_CONNECTIONS if connections is None else connections
+        opened = []
+        try:
+            for _ in range(max(connections, 1)):
+                conn = self.engine.connect()
+                opened.append(conn)
+                conn.execute(text("SELECT 1"))
+        finally:
+            for conn in opened:
+                conn.close()
+
+    def ping(self) -> bool:
+        """
+        Verifica se o banco responde.
+        """
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except SQLAlchemyError as e:
+            logger.warning("Banco de dados indisponível: %s", e)
+            return False
+
+    def dispose(self) -> None:
+        self._executor.shutdown(wait=True)
+        if self.write_queue is not None:
+            self.write_queue.stop()
+        if self.read_engine is not self.engine:
+            self.read_engine.dispose()
+        self.engine.dispose()
 
 
     ''' # Validação básica para evitar erro silencioso
@@ -56,10 +199,57 @@ class DatabaseService:
     
     def get_session(self) -> Session:
         return self.SessionLocal()
+
+    def run_write(self, fn: Callable[[Connection], Any]) -> Any:
+        """
+        Executa `fn(conn)` dentro de uma transação e devolve o seu retorno.
+        No modo SQLite de produção a escrita é feita pela thread gravadora.
+        """
+        if self.write_queue is not None:
+            return self.write_queue.submit(fn)
+        with self.engine.begin() as conn:
+            return fn(conn)
+
+    async def run_async(self, method: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Executa um método síncrono do serviço fora do event loop e aguarda o resultado.
+
+        Use a partir de corrotinas: a espera pelo banco (ou pela thread gravadora do
+        SQLite) não bloqueia o loop, e escritas de emissões concorrentes chegam juntas
+        à fila de escrita, onde são agrupadas em lotes.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()  # preserva o perfil da emissão amostrada
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, method, *args, **kwargs)
+        )
+
+    @staticmethod
+    def _rows_to_dicts(fields, rows) -> List[Dict[str, Any]]:
+        """
+        Converte tuplas de uma projeção em dicts. Datetimes ficam como objetos
+        (o encoder JSON os serializa em ISO 8601); só `date` mantém o formato dd/mm/AAAA.
+        """
+        results = [dict(zip(fields, row)) for row in rows]
+        if "date" in fields:
+            for item in results:
+                value = item["date"]
+                if isinstance(value, (datetime, date)):
+                    item["date"] = value.strftime("%d/%m/%Y")
+        return results
     
 
-    def create_nfse(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        session = self.get_session()
+    @profiled
+    def create_nfse(
+        self, data: Dict[str, Any], idempotency_key: Optional[str] = None, fingerprint: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Cria o registro da NFSe. Com `idempotency_key`, uma nota com a mesma chave
+        criada dentro de `IDEMPOTENCY_WINDOW_SECONDS` é devolvida no lugar de uma nova
+        (`created=False`). Chaves mais antigas que a janela, ou de notas que falharam
+        (ver `releases_key`), são liberadas e reutilizadas. Se `fingerprint` (hash do
+        payload) não bater com o gravado junto da chave, levanta `IdempotencyConflictError`.
+        """
         try:
             nfse_uuid = str(uuid.uuid4())
             data_emissao = datetime.strptime(data['data_emissao'], '%d/%m/%Y').date()
@@ -67,13 +257,16 @@ class DatabaseService:
             insert_sql = text("""
             INSERT INTO invoices (
                 uuid, cnpj, date, client_cnpj, client_phone, client_email,
-                invoice_value, cnae_code, cnae_service, city, invoice_description, status, created_at, updated_at
+                invoice_value, cnae_code, cnae_service, city, invoice_description, status, attempts,
+                idempotency_key, idempotency_fingerprint, created_at, updated_at
             ) VALUES (
                 :uuid, :cnpj, :date, :client_cnpj, :client_phone, :client_email,
-                :invoice_value, :cnae_code, :cnae_service, :city, :invoice_description, :status, :created_at, :updated_at
+                :invoice_value, :cnae_code, :cnae_service, :city, :invoice_description, :status, :attempts,
+                :idempotency_key, :idempotency_fingerprint, :created_at, :updated_at
             )
             """)
 
+            now = datetime.utcnow()
             params = {
                 "uuid": nfse_uuid,
                 "cnpj": data['cnpj_emissor'],
@@ -87,34 +280,83 @@ class DatabaseService:
                 "city": data['city'],
                 "invoice_description": data['descricao_servico'],
                 "status": "PROCESSING",
-                "created_at": datetime.now(),
-                "updated_at": datetime.now(),
+                "attempts": 0,
+                "idempotency_key": idempotency_key,
+                "idempotency_fingerprint": fingerprint if idempotency_key else None,
+                "created_at": now,
+                "updated_at": now,
             }
-
-            session.execute(insert_sql, params)
-            session.commit()
-
-            result = session.execute(text("SELECT id FROM invoices WHERE uuid = :uuid"), {"uuid": nfse_uuid})
-            nfse_id = result.scalar_one_or_none()
-
-            logger.info(f"NFSe criada com UUID: {nfse_uuid}, ID: {nfse_id}")
-
-            return {"id": nfse_id, "uuid": nfse_uuid, "status": "PROCESSING"}
+            window_start = now - timedelta(seconds=settings.IDEMPOTENCY_WINDOW_SECONDS)
+
+            def _replay(existing: Dict[str, Any]) -> Dict[str, Any]:
+                stored = existing["idempotency_fingerprint"]
+                if fingerprint and stored and stored != fingerprint:
+                    raise IdempotencyConflictError(
+                        "Idempotency-Key já usada com um payload diferente; use uma nova chave"
+                    )
+                return {"id": existing["id"], "uuid": existing["uuid"], "status": existing["status"], "created": False}
+
+            def _insert(conn: Connection):
+                if idempotency_key:
+                    existing = self._find_by_idempotency_key(conn, idempotency_key)
+                    if existing:
+                        in_window = existing["created_at"] and existing["created_at"] >= window_start
+                        if in_window and not releases_key(existing["status"], existing["error_code"]):
+                            return _replay(existing)
+                        # Fora da janela ou nota com falha: a chave antiga deixa de valer
+                        conn.execute(
+                            text("UPDATE invoices SET idempotency_key = NULL WHERE id = :id"), {"id": existing["id"]}
+                        )
+
+                conn.execute(insert_sql, params)
+                result = conn.execute(text("SELECT id FROM invoices WHERE uuid = :uuid"), {"uuid": nfse_uuid})
+                return {"id": result.scalar_one_or_none(), "uuid": nfse_uuid, "status": "PROCESSING", "created": True}
+
+            try:
+                record = self.run_write(_insert)
+            except IntegrityError:
+                if not idempotency_key:
+                    raise
+                # Outra requisição com a mesma chave inseriu primeiro: devolve a dela
+                with self.read_engine.connect() as conn:
+                    existing = self._find_by_idempotency_key(conn, idempotency_key)
+                if not existing:
+                    raise
+                record = _replay(existing)
+
+            if record["created"]:
+                logger.info(f"NFSe criada com UUID: {record['uuid']}, ID: {record['id']}")
+            else:
+                logger.info(f"Requisição idempotente repetida; reutilizando NFSe {record['uuid']}")
+
+            return record
 
         except SQLAlchemyError as e:
-            session.rollback()
             logger.error(f"Erro ao criar NFSe: {e}")
             raise
-        finally:
-            session.close()
+
+    @staticmethod
+    def _find_by_idempotency_key(conn: Connection, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            select(
+                Invoice.id, Invoice.uuid, Invoice.status, Invoice.error_code,
+                Invoice.idempotency_fingerprint, Invoice.created_at,
+            )
+            .where(Invoice.idempotency_key == idempotency_key)
+        ).mappings().first()
+        return dict(row) if row else None
 
     
-    def update_nfse(self, nfse_uuid: str, updates: Dict[str, Any]) -> bool:
+    @profiled
+    def update_nfse(
+        self, nfse_uuid: str, updates: Dict[str, Any], only_statuses: Optional[tuple] = None
+    ) -> bool:
         """
         Atualiza um registro de NFSe (tabela invoices) usando SQLAlchemy Core.
-        Aceita somente os campos definidos em `allowed_fields`.
+        Aceita somente os campos definidos em `allowed_fields`. Com `only_statuses`,
+        só atualiza se o status atual for um deles.
         """
-        allowed_fields = {"numero_nfse", "pdf_url", "xml_url", "status"}
+        allowed_fields = {"numero_nfse", "pdf_url", "xml_url", "status", "attempts", "error_code"}
         set_fields = {k: v for k, v in updates.items() if k in allowed_fields}
 
         if not set_fields:
@@ -127,96 +369,131 @@ class DatabaseService:
         # Gera a parte SET dinâmica:  "campo1 = :campo1, campo2 = :campo2 ..."
         set_clause = ", ".join(f"{field} = :{field}" for field in set_fields if field != "uuid")
 
-        sql = text(f"UPDATE invoices SET {set_clause} WHERE uuid = :uuid")
+        where_clause = "uuid = :uuid AND status IN :only_statuses" if only_statuses else "uuid = :uuid"
 
-        session = self.get_session()
-        try:
-            result = session.execute(sql, set_fields)
-            session.commit()
+        sql = text(f"UPDATE invoices SET {set_clause} WHERE {where_clause}")
+        if only_statuses:
+            sql = sql.bindparams(bindparam("only_statuses", expanding=True))
+            set_fields["only_statuses"] = list(only_statuses)
 
-            updated = result.rowcount > 0
+        try:
+            updated = self.run_write(lambda conn: conn.execute(sql, set_fields).rowcount) > 0
             if updated:
                 logger.info("NFSe atualizada: %s", nfse_uuid)
             return updated
 
         except SQLAlchemyError as e:
-            session.rollback()
             logger.error("Erro ao atualizar NFSe: %s", e)
             raise
-        finally:
-            session.close()
 
     
-    def get_nfse(self, nfse_uuid: str) -> Optional[Dict[str, Any]]:
+    @profiled
+    def increment_attempts(self, nfse_uuid: str) -> int:
+        """
+        Incrementa o contador de tentativas de emissão e devolve o novo valor.
+        """
+        def _increment(conn: Connection):
+            conn.execute(
+                text("UPDATE invoices SET attempts = COALESCE(attempts, 0) + 1, updated_at = :updated_at WHERE uuid = :uuid"),
+                {"uuid": nfse_uuid, "updated_at": datetime.utcnow()},
+            )
+            return conn.execute(
+                text("SELECT attempts FROM invoices WHERE uuid = :uuid"), {"uuid": nfse_uuid}
+            ).scalar_one_or_none()
+
+        try:
+            return self.run_write(_increment) or 0
+
+        except SQLAlchemyError as e:
+            logger.error("Erro ao incrementar tentativas da NFSe: %s", e)
+            raise
+
+    
+    @profiled
+    def get_nfse(self, nfse_uuid: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Busca uma NFSe pelo UUID projetando só as colunas pedidas em `fields`
+        (todas de `INVOICE_FIELDS` por padrão).
+        """
+        fields = fields or self.INVOICE_FIELDS
+        query = select(*(Invoice.__table__.c[field] for field in fields)).where(Invoice.uuid == nfse_uuid)
+
         session = self.get_session()
         try:
-            nfse = session.query(Invoice).filter(Invoice.uuid == nfse_uuid).first()
-            if not nfse:
+            row = session.execute(query).first()
+            if row is None:
                 return None
+            return self._rows_to_dicts(fields, [row])[0]
+        finally:
+            session.close()
 
-            return {
-                "id": nfse.id,
-                "uuid": nfse.uuid,
-                "cnpj": nfse.cnpj,
-                "date": nfse.date.strftime("%d/%m/%Y") if nfse.date else None,
-                "client_cnpj": nfse.client_cnpj,
-                "client_phone": nfse.client_phone,
-                "client_email": nfse.client_email,
-                "invoice_value": float(nfse.invoice_value) if nfse.invoice_value else None,
-                "cnae_code": nfse.cnae_code,
-                "cnae_service": nfse.cnae_service,
-                "city": nfse.city,
-                "invoice_description": nfse.invoice_description,
-                "numero_nfse": nfse.numero_nfse,
-                "pdf_url": nfse.pdf_url,
-                "xml_url": nfse.xml_url,
-                "status": nfse.status,
-                "created_at": nfse.created_at.isoformat() if nfse.created_at else None,
-                "updated_at": nfse.updated_at.isoformat() if nfse.updated_at else None,
-            }
+    
+    @profiled
+    def get_nfse_statuses(self, nfse_uuids: List[str], changed_since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Busca o status de várias NFSes em uma única consulta (`IN`).
+        Projeta somente uuid, status, numero_nfse e URLs dos artefatos; se
+        `changed_since` for informado, devolve apenas as linhas com `updated_at` posterior.
+        """
+        if not nfse_uuids:
+            return []
+
+        query = select(
+            Invoice.uuid,
+            Invoice.status,
+            Invoice.numero_nfse,
+            Invoice.pdf_url,
+            Invoice.xml_url,
+            Invoice.updated_at,
+        ).where(Invoice.uuid.in_(nfse_uuids))
+
+        if changed_since is not None:
+            query = query.where(Invoice.updated_at > changed_since)
+
+        session = self.get_session()
+        try:
+            rows = session.execute(query).mappings().all()
+            return [
+                {
+                    "uuid": row["uuid"],
+                    "status": row["status"],
+                    "numero_nfse": row["numero_nfse"],
+                    "pdf_url": row["pdf_url"],
+                    "xml_url": row["xml_url"],
+                    "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
+                }
+                for row in rows
+            ]
+        except SQLAlchemyError as e:
+            logger.error(f"Erro ao buscar status em lote: {e}")
+            raise
         finally:
             session.close()
 
     
-    def list_nfses(self, limit: int = 50, offset: int = 0, status: Optional[str] = None) -> List[Dict[str, Any]]:
+    @profiled
+    def list_nfses(
+        self,
+        limit: int = 50,
+        offset: int = 0,
+        status: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
         """
         Lista NFSes com paginação e filtro opcional por status.
+        Usa projeção de colunas (Core) em vez de carregar objetos ORM.
         """
+        fields = fields or self.INVOICE_FIELDS
+        query = select(*(Invoice.__table__.c[field] for field in fields))
+
+        if status:
+            query = query.where(Invoice.status == status)
+
+        query = query.order_by(desc(Invoice.created_at)).limit(limit).offset(offset)
+
         session: Session = self.get_session()
         try:
-            query = session.query(Invoice)
-
-            if status:
-                query = query.filter(Invoice.status == status)
-
-            query = query.order_by(desc(Invoice.created_at)).limit(limit).offset(offset)
-            nfses = query.all()
-
-            formatted_results = []
-            for nfse in nfses:
-                # Formatando campos que são datetime ou date
-                formatted_results.append({
-                    "id": nfse.id,
-                    "uuid": nfse.uuid,
-                    "cnpj": nfse.cnpj,
-                    "date": nfse.date.strftime("%d/%m/%Y") if isinstance(nfse.date, (datetime, date)) else nfse.date,
-                    "client_cnpj": nfse.client_cnpj,
-                    "client_phone": nfse.client_phone,
-                    "client_email": nfse.client_email,
-                    "invoice_value": float(nfse.invoice_value) if nfse.invoice_value is not None else None,
-                    "cnae_code": nfse.cnae_code,
-                    "cnae_service": nfse.cnae_service,
-                    "city": nfse.city,
-                    "invoice_description": nfse.invoice_description,
-                    "numero_nfse": nfse.numero_nfse,
-                    "pdf_url": nfse.pdf_url,
-                    "xml_url": nfse.xml_url,
-                    "status": nfse.status,
-                    "created_at": nfse.created_at.isoformat() if isinstance(nfse.created_at, (datetime, date)) else nfse.created_at,
-                    "updated_at": nfse.updated_at.isoformat() if isinstance(nfse.updated_at, (datetime, date)) else nfse.updated_at,
-                })
-
-            return formatted_results
+            return self._rows_to_dicts(fields, session.execute(query).all())
 
         except Exception as e:
             logger.error(f"Erro ao listar NFSes: {e}")
@@ -225,11 +502,83 @@ class DatabaseService:
             session.close()
     
 
+    @profiled
+    def touch_nfses(self, uuids: set) -> int:
+        """
+        Renova o `updated_at` das NFSes em andamento de `uuids` (heartbeat das emissões
+        deste processo), para que o reconciliador de outros processos não as considere
+        interrompidas enquanto esperam na fila. Devolve quantas foram atualizadas.
+        """
+        if not uuids:
+            return 0
+        columns = Invoice.__table__.c
+        stmt = (
+            update(Invoice.__table__)
+            .where(columns.uuid.in_(list(uuids)), columns.status.in_(self.IN_FLIGHT_STATUSES))
+            .values(updated_at=datetime.utcnow())
+        )
+        try:
+            return self.run_write(lambda conn: conn.execute(stmt).rowcount)
+        except SQLAlchemyError as e:
+            logger.error("Erro ao renovar NFSes em andamento: %s", e)
+            raise
+
+    @profiled
+    def dead_letter_stale(self, cutoff: datetime, exclude: Optional[set] = None) -> List[str]:
+        """
+        Move para DEAD_LETTER as NFSes presas em PROCESSING/RETRYING sem atualização
+        desde `cutoff` (UTC), exceto as de `exclude` (emissões em andamento neste
+        processo). São emissões interrompidas, p.ex. por reinício do processo; não
+        há como retomá-las porque a senha do emissor não é persistida.
+        Devolve os UUIDs movidos.
+        """
+        columns = Invoice.__table__.c
+        stale = (
+            columns.status.in_(self.IN_FLIGHT_STATUSES),
+            or_(columns.updated_at.is_(None), columns.updated_at < cutoff),
+        )
+        query = select(columns.uuid).where(*stale)
+        if exclude:
+            query = query.where(columns.uuid.notin_(exclude))
+
+        update_sql = text("""
+            UPDATE invoices
+            SET status = 'DEAD_LETTER', error_code = COALESCE(error_code, :error_code), updated_at = :updated_at
+            WHERE uuid = :uuid AND status IN ('PROCESSING', 'RETRYING')
+              AND (updated_at IS NULL OR updated_at < :cutoff)
+        """)
+        log_sql = text("""
+            INSERT INTO logs (invoice_id, status, reason, created_at)
+            VALUES (:invoice_id, 'DEAD_LETTER', :reason, :created_at)
+        """)
+        reason = "Emissão interrompida sem conclusão; confira no portal antes de reenviar"
+
+        def _dead_letter(conn: Connection) -> List[str]:
+            moved = []
+            now = datetime.utcnow()
+            for nfse_uuid in conn.execute(query).scalars().all():
+                # A condição é repetida no UPDATE: a emissão pode ter avançado desde o SELECT
+                params = {"uuid": nfse_uuid, "error_code": NFSeErrorCode.UNKNOWN, "updated_at": now, "cutoff": cutoff}
+                if conn.execute(update_sql, params).rowcount:
+                    conn.execute(log_sql, {"invoice_id": nfse_uuid, "reason": reason, "created_at": now})
+                    moved.append(nfse_uuid)
+            return moved
+
+        try:
+            moved = self.run_write(_dead_letter)
+            if moved:
+                logger.warning("NFSes interrompidas movidas para DEAD_LETTER: %s", ", ".join(moved))
+            return moved
+
+        except SQLAlchemyError as e:
+            logger.error("Erro ao reconciliar NFSes interrompidas: %s", e)
+            raise
+
+    @profiled
     def create_log(self, nfse_uuid: str, status: str, message: Optional[str] = None) -> bool:
         """
         Cria um log para uma NFSe na tabela `logs`.
         """
-        session = self.get_session()
         try:
             insert_sql = text("""
                 INSERT INTO logs (invoice_id, status, reason, created_at)
@@ -243,39 +592,87 @@ class DatabaseService:
                 "created_at": datetime.utcnow(),
             }
 
-            session.execute(insert_sql, params)
-            session.commit()
+            self.run_write(lambda conn: conn.execute(insert_sql, params))
 
             logger.info(f"Log criado para NFSe {nfse_uuid}: {status}")
             return True
 
         except SQLAlchemyError as e:
-            session.rollback()
             logger.error(f"Erro ao criar log: {str(e)}")
             raise
-        finally:
-            session.close()
 
     
+    @profiled
     def get_logs(self, nfse_uuid: str) -> List[Dict[str, Any]]:
+        columns = Log.__table__.c
+        query = (
+            select(*(columns[field] for field in self.LOG_FIELDS))
+            .where(Log.invoice_id == nfse_uuid)
+            .order_by(Log.created_at.desc())
+        )
+
         session = self.get_session()
         try:
-            logs = session.query(Log).filter(Log.invoice_id == nfse_uuid).order_by(Log.created_at.desc()).all()
+            return self._rows_to_dicts(self.LOG_FIELDS, session.execute(query).all())
+        finally:
+            session.close()
+    
+
+    def save_profile(self, nfse_uuid: str, profile: Dict[str, Any]) -> bool:
+        """
+        Grava o resultado de uma emissão amostrada (ver `services.profiling`).
+        """
+        insert_sql = text("""
+            INSERT INTO invoice_profiles (invoice_id, total_ms, timeline, db_calls, cpu_profile, trace_paths, created_at)
+            VALUES (:invoice_id, :total_ms, :timeline, :db_calls, :cpu_profile, :trace_paths, :created_at)
+        """)
+        params = {
+            "invoice_id": nfse_uuid,
+            "total_ms": int(profile["total_ms"]),
+            "timeline": json.dumps(profile["timeline"]),
+            "db_calls": json.dumps(profile["db_calls"]),
+            "cpu_profile": profile["cpu_profile"],
+            "trace_paths": json.dumps(profile["trace_paths"]),
+            "created_at": datetime.utcnow(),
+        }
+
+        try:
+            self.run_write(lambda conn: conn.execute(insert_sql, params))
+            logger.info(f"Perfil gravado para NFSe {nfse_uuid}")
+            return True
+
+        except SQLAlchemyError as e:
+            logger.error(f"Erro ao gravar perfil: {str(e)}")
+            raise
 
+    def get_profiles(self, nfse_uuid: str) -> List[Dict[str, Any]]:
+        columns = InvoiceProfile.__table__.c
+        query = (
+            select(columns.id, columns.total_ms, columns.timeline, columns.db_calls,
+                   columns.cpu_profile, columns.trace_paths, columns.created_at)
+            .where(columns.invoice_id == nfse_uuid)
+            .order_by(columns.created_at.desc())
+        )
+
+        session = self.get_session()
+        try:
             return [
                 {
-                    "id": log.id,
-                    "invoice_id": log.invoice_id,
-                    "status": log.status,
-                    "reason": log.reason,
-                    "created_at": log.created_at.isoformat() if log.created_at else None,
+                    "id": row["id"],
+                    "total_ms": row["total_ms"],
+                    "timeline": json.loads(row["timeline"] or "[]"),
+                    "db_calls": json.loads(row["db_calls"] or "{}"),
+                    "cpu_profile": row["cpu_profile"],
+                    "trace_paths": json.loads(row["trace_paths"] or "[]"),
+                    "created_at": row["created_at"],
                 }
-                for log in logs
+                for row in session.execute(query).mappings().all()
             ]
         finally:
             session.close()
     
 
+    @profiled
     def get_emission_data(self) -> Optional[Dict[str, Any]]:
         """
         Busca as informações para emissão da nota (1ª na fila com status 'QUEUED').
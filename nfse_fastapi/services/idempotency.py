@@ -0,0 +1,57 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from services.retry_policy import NFSeErrorCode
+
+# Campos que não entram na chave automática (não identificam a nota)
+_EXCLUDED_FIELDS = {"senha_emissor"}
+
+# Status de falha definitiva: a chave é liberada para o cliente corrigir e reenviar
+_RELEASED_STATUSES = {"ERROR", "DEAD_LETTER"}
+
+
+class IdempotencyConflictError(Exception):
+    """A chave de idempotência já foi usada com um payload diferente."""
+
+
+def key_from_header(header_value: str, cnpj_emissor: str) -> str:
+    """
+    Chave armazenada para um cabeçalho `Idempotency-Key`.
+    Escopada pelo CNPJ emissor para que clientes diferentes não colidam.
+    """
+    raw = f"header:{cnpj_emissor.strip()}:{header_value.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def key_from_payload(data: Dict[str, Any]) -> str:
+    """
+    Chave automática: hash do `NFSeRequest` normalizado, sem a senha.
+    Espaços nas pontas são ignorados, e-mail não diferencia maiúsculas e o valor
+    é comparado com duas casas decimais.
+    """
+    normalized = {}
+    for field, value in data.items():
+        if field in _EXCLUDED_FIELDS:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        normalized[field] = value
+
+    if isinstance(normalized.get("email_cliente"), str):
+        normalized["email_cliente"] = normalized["email_cliente"].lower()
+    if normalized.get("valor") is not None:
+        normalized["valor"] = f"{float(normalized['valor']):.2f}"
+
+    raw = "payload:" + json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def releases_key(status: Optional[str], error_code: Optional[str]) -> bool:
+    """
+    Indica se uma nota existente libera sua chave de idempotência para uma nova
+    emissão. Só notas em andamento ou emitidas são devolvidas na repetição; falhas
+    (ex.: senha errada, tentativas esgotadas) liberam a chave. A exceção é
+    `DOWNLOAD_FAILURE`: a nota já foi transmitida e reenviar a duplicaria.
+    """
+    return status in _RELEASED_STATUSES and error_code != NFSeErrorCode.DOWNLOAD_FAILURE
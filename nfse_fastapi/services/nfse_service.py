@@ -1,8 +1,18 @@
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+import asyncio
+import importlib
 import os
 import uuid
 import logging
-from typing import Dict, Any, Tuple
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple
+from config.settings import settings
+from services.browser_manager import BrowserManager
+from services.concurrency import AdaptiveLimiter
+from services.profiling import current_profile, mark
+from services.retry_policy import NFSeErrorCode
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page
+    from services.concurrency import _Permit
 
 # Configurar o logging
 logging.basicConfig(level=logging.INFO)
@@ -20,51 +30,108 @@ def _split_city(city_field: str) -> Tuple[str, str]:
 class NFSeService:
     """Serviço responsável por emitir NFSe através de web‑scraping headless."""
 
-    def __init__(self) -> None:
+    # Erros que indicam portal sobrecarregado e reduzem o limite de concorrência
+    CONGESTION_ERRORS = frozenset({NFSeErrorCode.PORTAL_TIMEOUT, NFSeErrorCode.DOWNLOAD_FAILURE})
+
+    def __init__(
+        self,
+        limiter: Optional[AdaptiveLimiter] = None,
+        browser_manager: Optional[BrowserManager] = None,
+    ) -> None:
         self.download_dir = os.path.join(os.getcwd(), "downloads")
         os.makedirs(self.download_dir, exist_ok=True)
+        self.browser_manager = browser_manager or BrowserManager()
+        # Acima do número de contextos do navegador as emissões só esperariam na fila do
+        # BrowserManager: o limite adaptativo não passa do que chega de fato ao portal
+        self.limiter = limiter or AdaptiveLimiter(
+            max_limit=min(settings.NFSE_CONCURRENCY_MAX, self.browser_manager.max_contexts)
+        )
+
+    async def warmup(self) -> None:
+        """Carrega antecipadamente os módulos pesados.
+
+        Sempre importa o Playwright; com ``PLAYWRIGHT_PREWARM`` também já deixa o
+        Chromium compartilhado aberto e com ``S3_PREWARM`` importa o boto3.
+        """
+        await asyncio.to_thread(importlib.import_module, "playwright.async_api")
+
+        if settings.S3_PREWARM:
+            await asyncio.to_thread(importlib.import_module, "boto3")
+
+        if settings.PLAYWRIGHT_PREWARM:
+            await self.browser_manager.start()
+            logger.info("Chromium pré-aquecido")
+
+    async def close(self) -> None:
+        """Fecha o Chromium compartilhado e o Playwright."""
+        await self.browser_manager.close()
 
     async def emitir_nfse(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Emitir NFSe respeitando o limite adaptativo de emissões simultâneas.
+
+        Aguarda uma vaga no ``AdaptiveLimiter`` (global e por emissor) e devolve a
+        latência e o resultado da emissão como sinal de saúde do portal. A latência
+        só começa a contar quando o contexto do navegador é obtido.
+        """
+        mark("fila_concorrencia")
+        async with self.limiter.acquire(data.get("cnpj_emissor")) as permit:
+            try:
+                resultado = await self._emitir_nfse(data, permit)
+            except Exception:
+                permit.record(congested=True)
+                raise
+            permit.record(congested=resultado.get("error_code") in self.CONGESTION_ERRORS)
+            return resultado
+
+    async def _emitir_nfse(self, data: Dict[str, Any], permit: Optional["_Permit"] = None) -> Dict[str, Any]:
         """Emitir NFSe e devolver paths de PDF / XML e número gerado.
 
         Espera ``data`` com as seguintes chaves:
         cnpj_emissor, senha_emissor, data_emissao (dd/mm/AAAA), cnpj_cliente,
         telefone_cliente, email_cliente, valor (float) , cnae_code,
         cnae_service, city (ex. "São Paulo/SP"), descricao_servico.
-        """
-        # ⇒ valores derivados/formatados ------------------------------------
-        valor_fmt = f"{float(data['valor']):.2f}"
-        cidade, _ = _split_city(data["city"])
 
+        Em caso de falha, ``error_code`` traz um dos valores de ``NFSeErrorCode``.
+        """
         resultado: Dict[str, Any] = {
             "success": False,
             "message": "Falha desconhecida",
+            "error_code": NFSeErrorCode.UNKNOWN,
         }
 
-        async with async_playwright() as pw:
-            browser: Browser = await pw.chromium.launch(
-                headless=True,
-                args=[
-                    "--no-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-gpu",
-                    "--disable-web-security",
-                    "--disable-features=VizDisplayCompositor",
-                ],
-            )
-            context: BrowserContext = await browser.new_context(
-                viewport={"width": 1920, "height": 1080},
-                user_agent=(
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/118.0 Safari/537.36"
-                ),
-                accept_downloads=True,
-            )
-            page: Page = await context.new_page()
+        # ⇒ valores derivados/formatados ------------------------------------
+        try:
+            valor_fmt = f"{float(data['valor']):.2f}"
+        except (TypeError, ValueError):
+            resultado["message"] = f"Valor inválido: {data.get('valor')!r}"
+            resultado["error_code"] = NFSeErrorCode.VALIDATION
+            return resultado
+        cidade, _ = _split_city(data["city"])
+
+        # Importação tardia: o Playwright só é carregado na primeira emissão (ou no warmup)
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+        # O BrowserManager aguarda vaga no orçamento de memória e fecha o contexto ao final
+        mark("fila_navegador")
+        async with self.browser_manager.new_context(
+            viewport={"width": 1920, "height": 1080},
+            user_agent=(
+                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                "AppleWebKit/537.36 (KHTML, like Gecko) "
+                "Chrome/118.0 Safari/537.36"
+            ),
+            accept_downloads=True,
+        ) as context:
+            if permit is not None:
+                permit.start_clock()  # a espera pelo BrowserManager não é latência do portal
+            profile = current_profile()
+            tracing = False
+            page: "Page" = await context.new_page()
+            nota_enviada = False
 
             try:
                 # -----------------------------------------------------------------
+                mark("login")
                 logger.info("Abrindo painel de login do emissor NFSe")
                 await page.goto("https://www.nfse.gov.br/EmissorNacional/Login")
 
@@ -84,16 +151,29 @@ class NFSeService:
                     alerta = await page.query_selector("div.alert-warning.alert") or await page.query_selector("div[class*='alert-warning']")
                     if alerta:
                         texto_alerta = await alerta.text_content()
-                        if "Usuário e/ou senha inválidos" in texto_alerta or "Usuário informado deve ser um CPF(11 dígitos) ou CNPJ(14 dígitos)." in texto_alerta:
+                        if "Usuário e/ou senha inválidos" in texto_alerta:
+                            resultado["message"] = "Usuário e/ou senha inválidos"
+                            resultado["error_code"] = NFSeErrorCode.AUTH
+                        elif "Usuário informado deve ser um CPF(11 dígitos) ou CNPJ(14 dígitos)." in texto_alerta:
                             resultado["message"] = "Usuário e/ou senha inválidos"
+                            resultado["error_code"] = NFSeErrorCode.VALIDATION
                         else:
                             resultado["message"] = f"Erro após login: {texto_alerta.strip()}"
+                            resultado["error_code"] = NFSeErrorCode.VALIDATION
                         return resultado
                     else:
                         resultado["message"] = "Erro após login — sem redirecionamento e sem alerta visível"
+                        resultado["error_code"] = NFSeErrorCode.PORTAL_TIMEOUT
                         return resultado
 
+                # Emissões amostradas pelo profiling gravam um trace do Playwright.
+                # Só começa após o login, para que a senha digitada não vá para o trace.
+                if profile is not None:
+                    await context.tracing.start(screenshots=True, snapshots=True)
+                    tracing = True
+
                 # NOVA NFSe -------------------------------------------------------
+                mark("nova_nfse")
                 await page.click("#wgtAcessoRapido a")
 
                 await page.fill("#DataCompetencia", data["data_emissao"])
@@ -113,6 +193,7 @@ class NFSeService:
                 )
 
                 # Tomador ---------------------------------------------------------
+                mark("tomador")
                 await page.fill("#Tomador_Inscricao", data["cnpj_cliente"])
                 await page.click("button:has-text('Buscar')")
                 await page.fill("#Tomador_Telefone", data["telefone_cliente"])
@@ -121,11 +202,13 @@ class NFSeService:
                 await page.click("button:has-text('Avançar')")
 
                 # Local prestação -------------------------------------------------
+                mark("local_prestacao")
                 await page.click("#pnlLocalPrestacao label")
                 await page.fill("#pnlLocalPrestacao input.select2-search__field", cidade)
                 await page.click(f"text={data['city']}")
 
                 # Serviço ---------------------------------------------------------
+                mark("servico")
                 await page.fill(".select2-search__field", str(data["cnae_code"]))
                 await page.wait_for_selector(".select2-results__option", timeout=3000)
                 await page.press(".select2-search__field", "Enter")
@@ -134,6 +217,7 @@ class NFSeService:
                 await page.fill("#ServicoPrestado_Descricao", data["descricao_servico"])
                 await page.click("button:has-text('Avançar')")
 
+                mark("valores")
                 await page.fill("#Valores_ValorServico", valor_fmt)
 
                 await page.evaluate(
@@ -148,9 +232,15 @@ class NFSeService:
                 )
 
                 await page.click("button:has-text('Avançar')")
+
+                # A partir daqui a nota pode já ter sido transmitida: falhas não
+                # são mais "portal timeout" e não devem gerar nova emissão.
+                nota_enviada = True
+                mark("envio")
                 await page.click("#btnProsseguir")
 
                 # DOWNLOADS -------------------------------------------------------
+                mark("downloads")
                 async with page.expect_download() as dl_info:
                     await page.click("a:has-text('Baixar XML')")
                 xml_dl = await dl_info.value
@@ -170,6 +260,7 @@ class NFSeService:
                     {
                         "success": True,
                         "message": "NFSe emitida com sucesso",
+                        "error_code": None,
                         "xml_path": xml_path,
                         "pdf_path": pdf_path,
                         "numero_nfse": numero_nfse,
@@ -180,11 +271,18 @@ class NFSeService:
             except Exception as exc:
                 logger.exception("Erro durante a emissão: %s", exc)
                 resultado["message"] = f"Erro durante a emissão: {exc}"
+                if nota_enviada:
+                    resultado["error_code"] = NFSeErrorCode.DOWNLOAD_FAILURE
+                elif isinstance(exc, PlaywrightTimeoutError):
+                    resultado["error_code"] = NFSeErrorCode.PORTAL_TIMEOUT
                 return resultado
 
             finally:
-                await context.close()
-                await browser.close()
+                if tracing:
+                    try:
+                        await context.tracing.stop(path=profile.new_trace_path())
+                    except Exception as e:
+                        logger.warning("Erro ao gravar trace do Playwright: %s", e)
         return resultado
     
 
@@ -0,0 +1,144 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from config.settings import settings
+
+# Perfil da emissão em andamento (None = emissão não amostrada)
+_current_profile: ContextVar[Optional["EmissionProfile"]] = ContextVar("nfse_emission_profile", default=None)
+
+# Só um cProfile ativo por vez no processo (a partir do Python 3.12 o interpretador
+# recusa um segundo); chamadas que não conseguirem o lock ficam só com o tempo medido
+_cpu_profiler_lock = threading.Lock()
+
+
+def current_profile() -> Optional["EmissionProfile"]:
+    return _current_profile.get()
+
+
+def mark(step: str) -> None:
+    """Marca o início de uma etapa na linha do tempo da emissão amostrada (no-op se não amostrada)."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.mark(step)
+
+
+def profiled(fn: Callable) -> Callable:
+    """
+    Decorator para métodos do DatabaseService: só em emissões amostradas, mede
+    tempo e contagem e coleta o perfil de CPU da chamada.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        cpu = cProfile.Profile() if _cpu_profiler_lock.acquire(blocking=False) else None
+        start = time.perf_counter()
+        try:
+            if cpu is None:
+                return fn(*args, **kwargs)
+            return cpu.runcall(fn, *args, **kwargs)
+        finally:
+            profile.record_db_call(name, time.perf_counter() - start)
+            if cpu is not None:
+                _cpu_profiler_lock.release()
+                profile.record_cpu(cpu)
+
+    return wrapper
+
+
+class EmissionProfile:
+    """
+    Dados coletados de uma emissão amostrada: linha do tempo das etapas do
+    ``emitir_nfse``, chamadas ao banco, perfil de CPU e traces do Playwright.
+
+    O perfil de CPU (cProfile) cobre só os trechos síncronos da própria emissão,
+    isto é, as chamadas ao banco decoradas com ``@profiled``; o event loop e as
+    demais emissões não são instrumentados.
+    """
+
+    def __init__(self, nfse_uuid: str) -> None:
+        self.nfse_uuid = nfse_uuid
+        self.started_at = time.perf_counter()
+        self.timeline: List[Dict[str, Any]] = []
+        self.db_calls: Dict[str, Dict[str, float]] = {}
+        self.trace_paths: List[str] = []
+        self._cpu: Optional[pstats.Stats] = None
+        self._cpu_stats: Optional[str] = None
+        self._token = None
+
+    # -------------------------------------------------------------- coleta
+    def mark(self, step: str) -> None:
+        now_ms = (time.perf_counter() - self.started_at) * 1000
+        if self.timeline and self.timeline[-1]["duration_ms"] is None:
+            last = self.timeline[-1]
+            last["duration_ms"] = round(now_ms - last["start_ms"], 1)
+        self.timeline.append({"step": step, "start_ms": round(now_ms, 1), "duration_ms": None})
+
+    def record_db_call(self, method: str, elapsed: float) -> None:
+        entry = self.db_calls.setdefault(method, {"count": 0, "total_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] = round(entry["total_ms"] + elapsed * 1000, 3)
+
+    def record_cpu(self, cpu: cProfile.Profile) -> None:
+        if self._cpu is None:
+            self._cpu = pstats.Stats(cpu)
+        else:
+            self._cpu.add(cpu)
+
+    def new_trace_path(self) -> str:
+        directory = os.path.join(settings.PROFILING_DIR, self.nfse_uuid)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trace-{len(self.trace_paths) + 1}.zip")
+        self.trace_paths.append(path)
+        return path
+
+    # ------------------------------------------------------------ ciclo de vida
+    def __enter__(self) -> "EmissionProfile":
+        self._token = _current_profile.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._cpu is not None:
+            buffer = io.StringIO()
+            self._cpu.stream = buffer
+            self._cpu.sort_stats("cumulative").print_stats(settings.PROFILING_TOP_FUNCTIONS)
+            self._cpu_stats = buffer.getvalue()
+            self._cpu = None
+        self.mark("fim")
+        _current_profile.reset(self._token)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+            "timeline": [entry for entry in self.timeline if entry["step"] != "fim"],
+            "db_calls": self.db_calls,
+            "cpu_profile": self._cpu_stats,
+            "trace_paths": self.trace_paths,
+        }
+
+
+class ProfilingController:
+    """
+    Decide quais emissões são amostradas. A taxa começa em ``PROFILING_SAMPLE_RATE``
+    e pode ser alterada em tempo de execução pelo endpoint de admin.
+    """
+
+    def __init__(self, sample_rate: Optional[float] = None) -> None:
+        self.sample_rate = sample_rate if sample_rate is not None else settings.PROFILING_SAMPLE_RATE
+
+    def start(self, nfse_uuid: str) -> Optional[EmissionProfile]:
+        """Devolve um ``EmissionProfile`` para a emissão se ela for amostrada, senão None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return EmissionProfile(nfse_uuid)
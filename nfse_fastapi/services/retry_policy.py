@@ -0,0 +1,48 @@
+import random
+from typing import Optional
+
+from config.settings import settings
+
+
+class NFSeErrorCode:
+    """Códigos estruturados de falha devolvidos por ``NFSeService.emitir_nfse``."""
+
+    AUTH = "AUTH"                          # usuário e/ou senha inválidos
+    VALIDATION = "VALIDATION"              # dados rejeitados pelo portal ou inválidos na entrada
+    PORTAL_TIMEOUT = "PORTAL_TIMEOUT"      # portal lento / fora do ar antes do envio da nota
+    DOWNLOAD_FAILURE = "DOWNLOAD_FAILURE"  # nota enviada, mas falhou o download do XML/PDF
+    UNKNOWN = "UNKNOWN"
+
+
+class RetryPolicy:
+    """
+    Política de novas tentativas com backoff exponencial e jitter.
+
+    Somente as classes de erro transitórias são repetidas. ``DOWNLOAD_FAILURE``
+    fica de fora de propósito: a nota já foi transmitida ao portal e uma nova
+    emissão geraria um documento fiscal duplicado.
+    """
+
+    TRANSIENT_ERRORS = frozenset({NFSeErrorCode.PORTAL_TIMEOUT})
+
+    def __init__(
+        self,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+    ) -> None:
+        self.max_attempts = max_attempts if max_attempts is not None else settings.NFSE_RETRY_MAX_ATTEMPTS
+        self.base_delay = base_delay if base_delay is not None else settings.NFSE_RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else settings.NFSE_RETRY_MAX_DELAY
+
+    def is_retryable(self, error_code: Optional[str]) -> bool:
+        return error_code in self.TRANSIENT_ERRORS
+
+    def should_retry(self, error_code: Optional[str], attempts: int) -> bool:
+        """Indica se vale a pena tentar de novo após ``attempts`` tentativas."""
+        return self.is_retryable(error_code) and attempts < self.max_attempts
+
+    def next_delay(self, attempts: int) -> float:
+        """Espera (segundos) antes da próxima tentativa — "full jitter" sobre o backoff exponencial."""
+        backoff = min(self.max_delay, self.base_delay * (2 ** max(attempts - 1, 0)))
+        return random.uniform(0, backoff)
@@ -0,0 +1,140 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import Connection
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[[Connection], Any]
+
+
+def apply_sqlite_pragmas(engine: Engine, read_only: bool = False) -> None:
+    """
+    Configura os PRAGMAs de produção em cada nova conexão SQLite do `engine`.
+    """
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if not read_only:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+            cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB) * 1024 * 1024}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+
+class SQLiteWriteQueue:
+    """
+    Fila de escrita com uma única thread gravadora para SQLite.
+
+    Todas as escritas passam por aqui, evitando "database is locked" entre
+    conexões concorrentes. A thread agrupa até `batch_size` escritas pendentes em
+    uma única transação; se o lote falhar, cada escrita é refeita isoladamente
+    para que só a culpada receba a exceção.
+    """
+
+    _STOP = object()
+
+    def __init__(self, engine: Engine, batch_size: Optional[int] = None) -> None:
+        self.engine = engine
+        self.batch_size = max(1, batch_size or settings.SQLITE_WRITE_BATCH_SIZE)
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self.batches = 0
+        self.writes = 0
+        self.max_batch = 0
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: WriteFn) -> Any:
+        """
+        Enfileira `fn(conn)` e bloqueia até a transação do lote ser confirmada.
+        Devolve o retorno de `fn` ou propaga a exceção levantada por ela.
+        Bloqueia a thread chamadora: corrotinas devem chamar o DatabaseService via
+        `run_async`, senão o event loop trava e nenhuma escrita é agrupada.
+        """
+        if threading.current_thread() is self._thread:
+            # Escrita aninhada vinda da própria thread gravadora
+            with self.engine.begin() as conn:
+                return fn(conn)
+
+        future: Future = Future()
+        self._queue.put((fn, future))
+        return future.result()
+
+    def stop(self) -> None:
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+
+            batch: List[Tuple[WriteFn, Future]] = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        """Quantidade de lotes/escritas e tamanho dos lotes, para inspeção."""
+        return {
+            "batches": self.batches,
+            "writes": self.writes,
+            "avg_batch": round(self.writes / self.batches, 2) if self.batches else 0,
+            "max_batch": self.max_batch,
+        }
+
+    def _write_batch(self, batch: List[Tuple[WriteFn, Future]]) -> None:
+        self.batches += 1
+        self.writes += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        results = []
+        try:
+            with self.engine.begin() as conn:
+                for fn, _ in batch:
+                    results.append(fn(conn))
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            logger.warning("Lote de %s escritas falhou; reprocessando individualmente", len(batch))
+            for fn, future in batch:
+                self._write_one(fn, future)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _write_one(self, fn: WriteFn, future: Future) -> None:
+        try:
+            with self.engine.begin() as conn:
+                result = fn(conn)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)